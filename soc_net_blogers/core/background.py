@@ -0,0 +1,43 @@
+"""Фоновый пул потоков для долгой работы после коммита.
+
+Сюда уходит работа, которую не стоит делать в запросе: раскладка постов
+по лентам подписчиков, удаление ненужных файлов картинок. У миниатюр
+свой пул (posts.thumbnails), чтобы новые картинки не ждали за такой
+работой.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_WORKERS,
+            thread_name_prefix='background',
+        )
+    return _executor
+
+
+def _run(func, *args):
+    try:
+        func(*args)
+    finally:
+        close_old_connections()
+
+
+def run_after_commit(func, *args):
+    """Выполняет func(*args) в фоновом пуле после коммита.
+
+    При BACKGROUND_WORKERS = 0 — в текущем потоке, тоже после коммита.
+    """
+    if not settings.BACKGROUND_WORKERS:
+        transaction.on_commit(lambda: func(*args))
+        return
+    transaction.on_commit(
+        lambda: _get_executor().submit(_run, func, *args)
+    )
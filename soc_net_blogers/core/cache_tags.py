@@ -0,0 +1,51 @@
+"""Теги кэша для инвалидации фрагментов.
+
+Фрагмент объявляет, от каких тегов он зависит (например ``feed:all``
+или ``post:42``), и включает их текущие версии в ключ кэша. Запись в
+базу меняет версию тега, после чего все зависящие от него фрагменты
+получают новые ключи, а старые просто вытесняются по истечении срока.
+"""
+import hashlib
+import time
+import uuid
+
+from django.core.cache import cache
+
+KEY_PREFIX = 'cache_tag'
+
+
+def _key(tag):
+    return f'{KEY_PREFIX}:{tag}'
+
+
+def _new_version():
+    return f'{time.time():.6f}-{uuid.uuid4().hex[:8]}'
+
+
+def _get_versions(tags):
+    keys = [_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        # Вытесненный из кэша тег получает новую версию, а не начальную,
+        # иначе могли бы ожить старые фрагменты.
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def get_version(*tags):
+    """Общая версия набора тегов: меняется при инвалидации любого из них."""
+    joined = ':'.join(_get_versions(tags))
+    return hashlib.md5(joined.encode()).hexdigest()
+
+
+def get_versions(*tags):
+    """Версии тегов по отдельности, одним запросом к кэшу."""
+    return dict(zip(tags, _get_versions(tags)))
+
+
+def invalidate(*tags):
+    """Сбрасывает версии тегов."""
+    version = _new_version()
+    cache.set_many({_key(tag): version for tag in tags}, None)
@@ -0,0 +1,58 @@
+"""Отложенный рендеринг фрагментов, зависящих от пользователя.
+
+Тег ``{% late_include %}`` оставляет в странице метку вместо шаблона,
+а LateRenderMiddleware подставляет на её место фрагмент, отрендеренный
+для текущего запроса. Так страница с метками одинакова для всех
+посетителей и может целиком храниться в кэше, а шапка, форма
+комментария или кнопка подписки рендерятся при каждом ответе.
+
+Параметры фрагмента должны сериализоваться в JSON. Метка подписана,
+поэтому подделать её в тексте поста нельзя.
+"""
+import re
+
+from django.core import signing
+from django.template.loader import render_to_string
+
+SALT = 'core.late_render'
+PREFIX = '<!--late:'
+PLACEHOLDER = re.compile(r'<!--late:([\w.:\-]+)-->')
+
+
+def placeholder(template_name, context):
+    """Метка фрагмента template_name с параметрами context."""
+    token = signing.dumps([template_name, context], salt=SALT)
+    return f'{PREFIX}{token}-->'
+
+
+def fill(request, content):
+    """Подставляет в content фрагменты, отрендеренные для request."""
+    def render(match):
+        try:
+            template_name, context = signing.loads(match.group(1), salt=SALT)
+        except signing.BadSignature:
+            return ''
+        return render_to_string(template_name, context, request=request)
+    return PLACEHOLDER.sub(render, content)
+
+
+class LateRenderMiddleware:
+    """Заполняет метки отложенных фрагментов в HTML-ответах.
+
+    Должен стоять после AuthenticationMiddleware и CsrfViewMiddleware:
+    фрагментам нужен пользователь, а выданный в них CSRF-токен должен
+    попасть в куки ответа.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (not response.streaming
+                and response.get('Content-Type', '').startswith('text/html')
+                and PREFIX.encode() in response.content):
+            content = response.content.decode(response.charset)
+            response.content = fill(request, content)
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+        return response
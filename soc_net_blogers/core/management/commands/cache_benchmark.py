@@ -0,0 +1,68 @@
+import os
+import tempfile
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.sqlite_cache import SQLiteCache
+
+PAGE_SIZE = 10
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость SQLiteCache и LocMemCache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operations', type=int, default=5000,
+            help='Число операций каждого вида.'
+        )
+
+    def run(self, cache, operations):
+        value = {'html': 'x' * 2000}
+        keys = [f'key:{i}' for i in range(operations)]
+        results = {}
+        started = time.perf_counter()
+        for key in keys:
+            cache.set(key, value)
+        results['set'] = time.perf_counter() - started
+        started = time.perf_counter()
+        for key in keys:
+            cache.get(key)
+        results['get'] = time.perf_counter() - started
+        started = time.perf_counter()
+        for start in range(0, operations, PAGE_SIZE):
+            cache.get_many(keys[start:start + PAGE_SIZE])
+        results[f'get_many({PAGE_SIZE})'] = time.perf_counter() - started
+        cache.set('counter', 0)
+        started = time.perf_counter()
+        for _ in range(operations):
+            cache.incr('counter')
+        results['incr'] = time.perf_counter() - started
+        return results
+
+    def handle(self, *args, **options):
+        operations = options['operations']
+        params = {'OPTIONS': {'MAX_ENTRIES': operations * 2}}
+        with tempfile.TemporaryDirectory() as directory:
+            backends = {
+                'LocMemCache': LocMemCache('benchmark', params),
+                'SQLiteCache': SQLiteCache(
+                    os.path.join(directory, 'cache.sqlite3'), params
+                ),
+            }
+            results = {
+                name: self.run(cache, operations)
+                for name, cache in backends.items()
+            }
+        self.stdout.write(
+            f'{"Операция":<16}'
+            + ''.join(f'{name:>16}' for name in results)
+            + '   (операций в секунду)'
+        )
+        for operation in results['LocMemCache']:
+            self.stdout.write(f'{operation:<16}' + ''.join(
+                f'{operations / timings[operation]:>16.0f}'
+                for timings in results.values()
+            ))
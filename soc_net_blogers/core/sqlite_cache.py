@@ -0,0 +1,325 @@
+"""Кэш в файле SQLite, общий для всех процессов на одном сервере.
+
+В отличие от LocMemCache, каждый WSGI-воркер видит одни и те же записи,
+а инвалидация из одного процесса сразу действует во всех остальных.
+Внешний сервис не нужен: достаточно файла, указанного в LOCATION.
+
+Поддерживает вытеснение давно не использованных записей (LRU) при
+превышении MAX_ENTRIES или суммарного размера MAX_SIZE байт, атомарный
+incr и пакетные get_many/set_many. Время чтения записей копится в
+памяти процесса и пишется в файл пачками, поэтому чтение не берёт
+блокировку на запись; LRU от этого становится приблизительным.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.sqlite_cache.SQLiteCache',
+            'LOCATION': '/var/tmp/site-cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 10000, 'MAX_SIZE': 64 * 2 ** 20},
+        }
+    }
+"""
+import math
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' size INTEGER NOT NULL,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    # Число и суммарный размер записей ведут триггеры, чтобы проверка
+    # лимитов не сканировала таблицу на каждой записи.
+    'CREATE TABLE IF NOT EXISTS cache_stats ('
+    ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+    ' count INTEGER NOT NULL,'
+    ' size INTEGER NOT NULL'
+    ')',
+    'INSERT OR IGNORE INTO cache_stats VALUES (1, 0, 0)',
+    'CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN'
+    ' UPDATE cache_stats SET count = count + 1, size = size + new.size;'
+    ' END',
+    'CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN'
+    ' UPDATE cache_stats SET count = count - 1, size = size - old.size;'
+    ' END',
+    'CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache'
+    ' BEGIN'
+    ' UPDATE cache_stats SET size = size - old.size + new.size;'
+    ' END',
+)
+# Время последнего чтения обновляется не чаще раза в столько секунд,
+# чтобы частые чтения одной записи не превращались в записи в файл.
+ACCESS_RESOLUTION = 1.0
+# Прочитанные ключи пишутся в файл, когда их накопится TOUCH_BATCH
+# или пройдёт TOUCH_INTERVAL секунд, а также вместе с любой записью.
+TOUCH_BATCH = 100
+TOUCH_INTERVAL = 5.0
+# Доля записей, вытесняемых сверх лимита, чтобы не чистить на каждом set.
+CULL_RATIO = 0.1
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', 0)) or None
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        """Соединение на поток; после fork открывается заново."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            # Иначе INSERT OR REPLACE не вызывает триггер удаления.
+            connection.execute('PRAGMA recursive_triggers=ON')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            local.connection = connection
+            local.pid = os.getpid()
+            local.touched = {}
+            local.flushed = time.time()
+        return local.connection
+
+    @staticmethod
+    def _dump(value):
+        # Целые числа хранятся как INTEGER, чтобы incr был одним UPDATE.
+        if (isinstance(value, int) and not isinstance(value, bool)
+                and -2 ** 63 <= value < 2 ** 63):
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _rows(self, values, timeout):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        for key, value in values:
+            dumped = self._dump(value)
+            size = len(dumped) if isinstance(dumped, bytes) else 8
+            yield key, dumped, size, expires, now
+
+    def _write(self, rows, replace=True):
+        rows = list(rows)
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        connection = self._connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if not replace:
+                # Просроченная запись не должна мешать add().
+                connection.executemany(
+                    'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                    [(row[0], row[4]) for row in rows],
+                )
+            cursor = connection.executemany(
+                f'{verb} INTO cache (key, value, size, expires, accessed) '
+                'VALUES (?, ?, ?, ?, ?)',
+                rows,
+            )
+            rowcount = cursor.rowcount
+            # Перед вытеснением LRU должен знать о недавних чтениях.
+            self._flush_touched(connection)
+            self._cull(connection)
+        return rowcount
+
+    def _cull(self, connection):
+        count, total_size = connection.execute(
+            'SELECT count, size FROM cache_stats'
+        ).fetchone()
+        over_count = count > self._max_entries
+        over_size = self._max_size and total_size > self._max_size
+        if not (over_count or over_size):
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),)
+        )
+        count, total_size = connection.execute(
+            'SELECT count, size FROM cache_stats'
+        ).fetchone()
+        excess = 0
+        if count > self._max_entries:
+            excess = count - self._max_entries + int(
+                self._max_entries * CULL_RATIO
+            )
+        if excess:
+            self._evict(connection, excess)
+        if not self._max_size:
+            return
+        limit = self._max_size * (1 - CULL_RATIO)
+        # Число записей, которые надо вытеснить, оценивается по среднему
+        # размеру; если вытеснены записи меньше средней, шаг повторяется.
+        while True:
+            count, total_size = connection.execute(
+                'SELECT count, size FROM cache_stats'
+            ).fetchone()
+            if not count or total_size <= limit:
+                return
+            self._evict(connection, max(
+                1, math.ceil((total_size - limit) * count / total_size)
+            ))
+
+    @staticmethod
+    def _evict(connection, number):
+        """Удаляет number давно не читанных записей по индексу accessed."""
+        connection.execute(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+            (number,),
+        )
+
+    def _touch(self, keys, now):
+        """Запоминает чтение ключей; в файл оно попадёт позже."""
+        if not keys:
+            return
+        local = self._local
+        local.touched.update(dict.fromkeys(keys, now))
+        if (len(local.touched) >= TOUCH_BATCH
+                or now - local.flushed >= TOUCH_INTERVAL):
+            with self._connection as connection:
+                connection.execute('BEGIN IMMEDIATE')
+                self._flush_touched(connection)
+
+    def _flush_touched(self, connection):
+        """Пишет накопленные чтения в уже открытой транзакции."""
+        local = self._local
+        touched, local.touched = local.touched, {}
+        local.flushed = time.time()
+        if touched:
+            connection.executemany(
+                'UPDATE cache SET accessed = ? '
+                'WHERE key = ? AND accessed < ?',
+                [(accessed, key, accessed - ACCESS_RESOLUTION)
+                 for key, accessed in touched.items()],
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        return self._write(
+            self._rows([(key, value)], timeout), replace=False
+        ) == 1
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._get_many([key]).get(key, default)
+
+    def _get_many(self, keys):
+        now = time.time()
+        placeholders = ', '.join('?' * len(keys))
+        rows = self._connection.execute(
+            f'SELECT key, value, accessed FROM cache '
+            f'WHERE key IN ({placeholders}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            [*keys, now],
+        ).fetchall()
+        self._touch(
+            [key for key, _, accessed in rows
+             if accessed < now - ACCESS_RESOLUTION],
+            now,
+        )
+        return {key: self._load(value) for key, value, _ in rows}
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        found = {}
+        stored_keys = list(keys)
+        # Ограничение SQLite на число параметров в запросе.
+        for start in range(0, len(stored_keys), 500):
+            found.update(self._get_many(stored_keys[start:start + 500]))
+        return {keys[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._write(self._rows([(key, value)], timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write(self._rows(
+            [(self._key(key, version), value) for key, value in data.items()],
+            timeout,
+        ))
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        connection = self._connection
+        with connection:
+            cursor = connection.execute(
+                'UPDATE cache SET expires = ? '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time.time()),
+            )
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        connection = self._connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            cursor = connection.execute(
+                "UPDATE cache SET value = value + ? "
+                "WHERE key = ? AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                (delta, key, time.time()),
+            )
+            if cursor.rowcount != 1:
+                raise ValueError(f"Key '{key}' not found")
+            return connection.execute(
+                'SELECT value FROM cache WHERE key = ?', (key,)
+            ).fetchone()[0]
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        with self._connection as connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        with self._connection as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'DELETE FROM cache WHERE key = ?',
+                [(self._key(key, version),) for key in keys],
+            )
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._connection.execute(
+            'SELECT 1 FROM cache '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def clear(self):
+        with self._connection as connection:
+            connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединение живёт всё время работы процесса: открывать файл
+        # на каждый запрос дороже, чем держать его открытым.
+        pass
@@ -0,0 +1,18 @@
+from django import template
+
+from core.cache_tags import get_version
+
+register = template.Library()
+
+
+@register.simple_tag
+def cache_tags(*tags, **scoped_tags):
+    """Версия тегов для ключа фрагмента.
+
+    {% cache_tags 'feed:all' author=author.pk as version %} — версия
+    тегов ``feed:all`` и ``author:<pk>``.
+    """
+    tags += tuple(
+        f'{scope}:{value}' for scope, value in sorted(scoped_tags.items())
+    )
+    return get_version(*tags)
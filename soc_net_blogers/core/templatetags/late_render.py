@@ -0,0 +1,16 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core.late_render import placeholder
+
+register = template.Library()
+
+
+@register.simple_tag
+def late_include(template_name, **context):
+    """Метка фрагмента, который отрендерится при ответе.
+
+    {% late_include 'includes/header.html' %} — шапка подставится
+    для текущего пользователя даже в страницу, взятую из кэша.
+    """
+    return mark_safe(placeholder(template_name, context))
@@ -0,0 +1,32 @@
+import copy
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TempCacheRunner(DiscoverRunner):
+    """Запускает тесты с кэшем SQLite во временном каталоге.
+
+    Иначе тесты читали бы и чистили файл кэша работающего сайта.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.mkdtemp()
+        caches = copy.deepcopy(settings.CACHES)
+        for alias, options in caches.items():
+            if options['BACKEND'] == 'core.sqlite_cache.SQLiteCache':
+                options['LOCATION'] = os.path.join(
+                    self.cache_directory, f'{alias}.sqlite3'
+                )
+        self.cache_settings = override_settings(CACHES=caches)
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
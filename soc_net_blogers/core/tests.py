@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from .sqlite_cache import SQLiteCache
+
+INCREMENTS_PER_PROCESS = 200
+
+
+def increment_counter(path):
+    cache = SQLiteCache(path, {})
+    for _ in range(INCREMENTS_PER_PROCESS):
+        cache.incr('counter')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {
+            'OPTIONS': {'MAX_ENTRIES': 10},
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_get_set_delete(self):
+        """Запись, чтение, удаление и срок жизни записей."""
+        self.cache.set('object', {'a': [1, 2]})
+        self.cache.set('number', 5)
+        self.assertEqual(self.cache.get('object'), {'a': [1, 2]})
+        self.assertEqual(self.cache.get('number'), 5)
+        self.assertFalse(self.cache.add('number', 6))
+        self.cache.delete('number')
+        self.assertIsNone(self.cache.get('number'))
+        self.cache.set('expired', 1, timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertTrue(self.cache.add('expired', 2))
+
+    def test_many(self):
+        """get_many и set_many работают с пачкой ключей."""
+        self.cache.set_many({'a': 1, 'b': 'два'})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': 'два'})
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b']), {})
+
+    def test_shared_between_instances(self):
+        """Записи видны другому экземпляру с тем же файлом."""
+        self.cache.set('shared', 'value')
+        other = SQLiteCache(self.path, {})
+        self.assertEqual(other.get('shared'), 'value')
+
+    def test_incr_is_atomic_across_processes(self):
+        """incr из нескольких процессов не теряет приращений."""
+        self.cache.set('counter', 0)
+        processes = [
+            multiprocessing.Process(target=increment_counter,
+                                    args=(self.path,))
+            for _ in range(3)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.cache.get('counter'),
+                         3 * INCREMENTS_PER_PROCESS)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_lru_eviction(self):
+        """При переполнении вытесняются давно не читанные записи."""
+        for i in range(10):
+            self.cache.set(f'key{i}', i)
+        connection = self.cache._connection
+        connection.execute('UPDATE cache SET accessed = 0')
+        connection.execute(
+            'UPDATE cache SET accessed = ? WHERE key LIKE ?',
+            (time.time(), '%key0'),
+        )
+        self.cache.set('new', 'value')
+        self.assertEqual(self.cache.get('key0'), 0)
+        self.assertEqual(self.cache.get('new'), 'value')
+        self.assertIsNone(self.cache.get('key1'))
+
+    def test_reads_touched_in_batches(self):
+        """Чтение не пишет в файл сразу: время чтения копится и
+        записывается вместе со следующей записью."""
+        self.cache.set('key', 'value')
+        connection = self.cache._connection
+        connection.execute('UPDATE cache SET accessed = 0')
+        self.cache.get('key')
+        accessed, = connection.execute(
+            'SELECT accessed FROM cache').fetchone()
+        self.assertEqual(accessed, 0)
+        self.cache.set('other', 'value')
+        accessed, = connection.execute(
+            "SELECT accessed FROM cache WHERE key LIKE '%key'").fetchone()
+        self.assertGreater(accessed, 0)
+
+    def test_tests_use_temporary_cache(self):
+        """Тесты не трогают файл кэша сайта."""
+        self.assertNotEqual(
+            os.path.dirname(settings.CACHES['default']['LOCATION']),
+            str(settings.BASE_DIR),
+        )
+
+    def test_size_limit(self):
+        """Суммарный размер записей не превышает MAX_SIZE."""
+        cache = SQLiteCache(os.path.join(self.directory, 'sized.sqlite3'), {
+            'OPTIONS': {'MAX_SIZE': 10000},
+        })
+        for i in range(20):
+            cache.set(f'key{i}', 'x' * 1000)
+        size, = cache._connection.execute(
+            'SELECT SUM(size) FROM cache').fetchone()
+        self.assertLessEqual(size, 10000)
+        self.assertIsNotNone(cache.get('key19'))
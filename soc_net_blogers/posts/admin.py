@@ -1,31 +1,272 @@
+import logging
+from datetime import date, timedelta
+
+from django import forms
 from django.conf import settings
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db import DatabaseError, models
+from django.db.models import Max, Min
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 
+from . import bulk, search
+from .forms import CachedModelChoiceField
 from .models import Comment, Follow, Group, Post
+from .paginator import DeferredJoinPaginator
+
+logger = logging.getLogger(__name__)
+
+
+class FullTextSearchMixin:
+    """Поиск в админке через полнотекстовый индекс вместо LIKE."""
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search.enabled():
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        return search.filter_queryset(queryset, search_term), False
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """Фильтр по связанному объекту с выбором через autocomplete.
+
+    Вместо строки на каждый объект в панели выводится поле select2,
+    которое подгружает варианты по мере ввода из autocomplete админки
+    связанной модели (у неё должны быть заданы search_fields). Выборка
+    фильтруется по внешнему ключу, то есть по его индексу.
+    """
+    template = 'admin/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin,
+                 field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin,
+                         field_path)
+        self.form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field.remote_field,
+                                      model_admin.admin_site),
+            required=False,
+        )
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': changelist.get_query_string(
+                remove=[self.lookup_kwarg]
+            ),
+            'display': _('All'),
+        }
+
+    def widget(self):
+        """Поле выбора; читает из базы только выбранный объект."""
+        return self.form_field.widget.render(
+            self.lookup_kwarg, self.lookup_val,
+            attrs={'id': f'autocomplete-filter-{self.field_path}'},
+        )
+
+
+class AutocompleteFilterMixin:
+    """Подключает к списку скрипты select2 для AutocompleteFilter."""
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, None).media
+
+
+class DateRangeQuerySet(models.QuerySet):
+    """Выборка, у которой dates() перечисляет периоды между MIN и MAX.
+
+    Навигация по датам (date_hierarchy) вызывает dates() для всей
+    отфильтрованной выборки, а SELECT DISTINCT по усечённой дате читает
+    каждую её строку. MIN и MAX поля читаются по его индексу; периоды
+    без записей тоже попадают в список. Поле — DateTimeField.
+    """
+
+    def dates(self, field_name, kind, order='ASC'):
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        first, last = (
+            (timezone.localtime(value) if settings.USE_TZ else value).date()
+            for value in (bounds['first'], bounds['last'])
+        )
+        if kind == 'year':
+            periods = [date(year, 1, 1)
+                       for year in range(first.year, last.year + 1)]
+        elif kind == 'month':
+            periods = [
+                date(month // 12, month % 12 + 1, 1)
+                for month in range(first.year * 12 + first.month - 1,
+                                   last.year * 12 + last.month)
+            ]
+        else:
+            periods = [first + timedelta(days=days)
+                       for days in range((last - first).days + 1)]
+        return periods[::-1] if order == 'DESC' else periods
+
+
+class BulkDeleteMixin:
+    """Заменяет удаление выбранных через Collector пачечным.
+
+    bulk_delete — функция из posts.bulk для модели админки. Перед
+    удалением показывается подтверждение с числом записей, без
+    перечисления всех связанных объектов.
+    """
+    bulk_delete = None
+
+    def run_in_chunks(self, request, func, *args):
+        """Вызывает функцию из posts.bulk.
+
+        Каждая пачка коммитится отдельно, поэтому при ошибке в середине
+        сообщает, сколько записей уже обработано, и возвращает None.
+        """
+        done = total = 0
+
+        def progress(chunk_done, chunk_total):
+            nonlocal done, total
+            done, total = chunk_done, chunk_total
+
+        try:
+            return func(*args, progress=progress)
+        except DatabaseError:
+            logger.exception('Пакетное действие прервано')
+            self.message_user(
+                request,
+                f'Обработано записей: {done} из {total}, затем произошла '
+                f'ошибка базы данных. Повторите действие для остальных.',
+                messages.ERROR,
+            )
+            return None
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def delete_in_chunks(self, request, queryset):
+        if request.POST.get('post') != 'yes':
+            return TemplateResponse(
+                request, 'admin/bulk_delete_confirmation.html', {
+                    **self.admin_site.each_context(request),
+                    'title': 'Вы уверены?',
+                    'opts': self.model._meta,
+                    'count': queryset.count(),
+                    'selected': request.POST.getlist(
+                        helpers.ACTION_CHECKBOX_NAME
+                    ),
+                    'select_across': request.POST.get('select_across', 0),
+                    'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+                    'media': self.media,
+                }
+            )
+        deleted = self.run_in_chunks(request, self.bulk_delete, queryset)
+        if deleted is not None:
+            self.message_user(request, f'Удалено записей: {deleted}.',
+                              messages.SUCCESS)
+
+    delete_in_chunks.allowed_permissions = ('delete',)
+    delete_in_chunks.short_description = (
+        'Удалить выбранные %(verbose_name_plural)s'
+    )
+
+
+class PostActionForm(helpers.ActionForm):
+    group = forms.ModelChoiceField(Group.objects.all(), required=False,
+                                   label='Группа')
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(FullTextSearchMixin, BulkDeleteMixin, admin.ModelAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group')
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
+    # На больших таблицах точный COUNT и OFFSET по полным строкам
+    # дороже самой страницы: считаем оценку и листаем по id.
+    paginator = DeferredJoinPaginator
+    show_full_result_count = False
+    autocomplete_fields = ('author',)
+    actions = ('delete_in_chunks', 'move_to_group', 'remove_from_group')
+    action_form = PostActionForm
+    bulk_delete = staticmethod(bulk.delete_posts)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'group':
+            # Один список групп на всю страницу, а не запрос на строку.
+            kwargs.setdefault('form_class', CachedModelChoiceField)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def move_to_group(self, request, queryset):
+        # Значение уже проверено формой действий.
+        group = Group.objects.filter(
+            pk=request.POST.get('group') or None
+        ).first()
+        if group is None:
+            self.message_user(request, 'Выберите группу.', messages.ERROR)
+            return
+        moved = self.run_in_chunks(request, bulk.move_to_group, queryset,
+                                   group)
+        if moved is not None:
+            self.message_user(
+                request, f'Перенесено в группу «{group}»: {moved}.',
+                messages.SUCCESS,
+            )
+
+    move_to_group.allowed_permissions = ('change',)
+    move_to_group.short_description = 'Перенести в группу'
+
+    def remove_from_group(self, request, queryset):
+        removed = self.run_in_chunks(request, bulk.move_to_group, queryset,
+                                     None)
+        if removed is not None:
+            self.message_user(request, f'Убрано из групп: {removed}.',
+                              messages.SUCCESS)
+
+    remove_from_group.allowed_permissions = ('change',)
+    remove_from_group.short_description = 'Убрать из группы'
 
 
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
-    pass
+    search_fields = ('title', 'slug')
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, AutocompleteFilterMixin,
+                   BulkDeleteMixin, admin.ModelAdmin):
     list_display = ('pk', 'text', 'created', 'author', 'post')
+    list_select_related = ('author', 'post__author', 'post__group')
     search_fields = ('text',)
-    list_filter = ('created', 'author')
+    list_filter = (('author', AutocompleteFilter),)
+    date_hierarchy = 'created'
+    actions = ('delete_in_chunks',)
+    bulk_delete = staticmethod(bulk.delete_comments)
+    paginator = DeferredJoinPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return DateRangeQuerySet(queryset.model, queryset.query,
+                                 queryset.db)
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('pk', 'user', 'author')
-    list_filter = ('author',)
+    list_select_related = ('user', 'author')
+    list_filter = (
+        ('author', AutocompleteFilter),
+        ('user', AutocompleteFilter),
+    )
+    paginator = DeferredJoinPaginator
+    show_full_result_count = False
@@ -0,0 +1,127 @@
+"""Массовые действия над постами и комментариями для админки.
+
+Удаление через Collector загружает каждый связанный комментарий и
+запись ленты и удаляет строки по одной, вызывая сигналы. Здесь записи
+обрабатываются пачками по BULK_CHUNK_SIZE id: каждая пачка — отдельная
+короткая транзакция, в которой каждая таблица чистится одним DELETE,
+а работа сигналов (счётчики, поисковый индекс, теги кэша) делается
+сразу для всей пачки. Файлы картинок и их миниатюры удаляются после
+коммита в фоновом пуле core.background, если на файл больше не
+ссылается ни один пост.
+
+Строки удаляются через QuerySet._raw_delete, без Collector, поэтому
+каждая связанная с постом таблица должна чиститься здесь явно; тест
+test_bulk_delete_knows_all_relations напомнит об этом при новой связи.
+
+Функции принимают progress(done, total) и вызывают его после каждой
+пачки.
+"""
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import background, cache_tags
+
+from . import counters, images, search
+from .models import Comment, Post, TimelineEntry
+from .signals import post_tags
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(queryset, size):
+    """id выборки пачками по возрастанию, без OFFSET."""
+    ids = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        rest = ids if last is None else ids.filter(pk__gt=last)
+        chunk = list(rest[:size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def _run(queryset, process_chunk, progress):
+    """Обрабатывает выборку пачками, по транзакции на пачку."""
+    total = queryset.count()
+    done = 0
+    for ids in _chunks(queryset, settings.BULK_CHUNK_SIZE):
+        with transaction.atomic():
+            tags = process_chunk(ids)
+        cache_tags.invalidate(*tags)
+        done += len(ids)
+        logger.info('%s: обработано %d из %d',
+                    queryset.model._meta.verbose_name_plural, done, total)
+        if progress is not None:
+            progress(done, total)
+    return done
+
+
+def _post_tags(rows):
+    tags = set()
+    for pk, author_id, group_id, *_ in rows:
+        tags |= post_tags(pk, author_id, group_id)
+    return tags
+
+
+def _delete_posts(ids):
+    posts = Post.objects.filter(pk__in=ids)
+    rows = list(posts.values_list('pk', 'author_id', 'group_id', 'image'))
+    comments = Comment.objects.filter(post_id__in=ids)
+    search.unindex_queryset(comments)
+    search.unindex_queryset(posts)
+    # В обход сигналов: их работа сделана для всей пачки.
+    comments._raw_delete(comments.db)
+    TimelineEntry.objects.filter(post_id__in=ids).delete()
+    posts._raw_delete(posts.db)
+    authors = Counter(author_id for _, author_id, _, _ in rows)
+    for author_id, count in authors.items():
+        counters.change_user(author_id, posts_count=-count)
+    image_names = {image for *_, image in rows if image}
+    if image_names:
+        background.run_after_commit(images.release_many, image_names)
+    return _post_tags(rows)
+
+
+def _delete_comments(ids):
+    comments = Comment.objects.filter(pk__in=ids)
+    post_ids = Counter(comments.values_list('post_id', flat=True))
+    search.unindex_queryset(comments)
+    comments._raw_delete(comments.db)
+    for post_id, count in post_ids.items():
+        counters.change_post(post_id, -count)
+    return {f'post:{post_id}' for post_id in post_ids}
+
+
+def delete_posts(queryset, progress=None):
+    """Удаляет посты выборки с комментариями и записями лент.
+
+    Возвращает число удалённых постов.
+    """
+    return _run(queryset, _delete_posts, progress)
+
+
+def delete_comments(queryset, progress=None):
+    """Удаляет комментарии выборки. Возвращает их число."""
+    return _run(queryset, _delete_comments, progress)
+
+
+def move_to_group(queryset, group, progress=None):
+    """Переносит посты выборки в группу group; None убирает посты из
+    групп. Возвращает число перенесённых постов.
+    """
+    def move_chunk(ids):
+        posts = Post.objects.filter(pk__in=ids)
+        rows = list(posts.values_list('pk', 'author_id', 'group_id'))
+        # Новое время изменения даёт карточкам новые ключи кэша.
+        posts.update(group=group, updated=timezone.now())
+        tags = _post_tags(rows)
+        if group is not None:
+            tags.add(f'group:{group.pk}')
+        return tags
+
+    return _run(queryset, move_chunk, progress)
@@ -0,0 +1,77 @@
+"""Кэш отрендеренных карточек постов, общий для всех лент.
+
+Ключ карточки включает id поста, время его последнего изменения и
+версии тегов автора и группы (см. posts.signals), поэтому правка поста,
+его автора или группы сразу даёт новый ключ. Страница ленты собирается
+одним get_many по карточкам своих постов; отсутствующие рендерятся
+с заранее выбранными миниатюрами и сохраняются одним set_many.
+Карточка, для которой ещё построены не все миниатюры, хранится лишь
+POST_CARD_PENDING_TIMEOUT секунд.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from core import cache_tags
+
+from . import thumbnails
+
+TEMPLATE = 'posts/includes/post_card.html'
+
+
+def card_tags(post):
+    """Теги записей, которые видны на карточке, кроме самого поста."""
+    tags = [f'author:{post.author_id}']
+    if post.group_id is not None:
+        tags.append(f'group:{post.group_id}')
+    return tags
+
+
+def card_key(post, show_author, versions):
+    """Ключ карточки; versions — версии тегов card_tags(post)."""
+    joined = ':'.join(versions[tag] for tag in card_tags(post))
+    version = hashlib.md5(joined.encode()).hexdigest()
+    return (f'post_card:{post.pk}:{post.updated.timestamp()}:'
+            f'{int(show_author)}:{version}')
+
+
+def render_cards(posts, show_author=True):
+    """Список HTML карточек для постов в том же порядке."""
+    versions = cache_tags.get_versions(
+        *{tag for post in posts for tag in card_tags(post)}
+    )
+    keys = [card_key(post, show_author, versions) for post in posts]
+    cards = cache.get_many(keys)
+    posts = {key: post for key, post in zip(keys, posts) if key not in cards}
+    prefetched = thumbnails.prefetch(
+        post.image.name for post in posts.values() if post.image
+    )
+    missing, pending = {}, {}
+    for key, post in posts.items():
+        variants = prefetched.get(post.image.name)
+        html = render_to_string(TEMPLATE, {
+            'post': post,
+            'show_author': show_author,
+            'thumbnails': variants,
+        })
+        if variants is None or thumbnails.is_complete(variants,
+                                                      post.image_width):
+            missing[key] = html
+        else:
+            pending[key] = html
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+    if pending:
+        cache.set_many(pending, settings.POST_CARD_PENDING_TIMEOUT)
+    cards.update(missing)
+    cards.update(pending)
+    return [cards[key] for key in keys]
+
+
+def invalidate(post):
+    """Удаляет из кэша карточки поста в текущей редакции."""
+    versions = cache_tags.get_versions(*card_tags(post))
+    cache.delete_many([card_key(post, True, versions),
+                       card_key(post, False, versions)])
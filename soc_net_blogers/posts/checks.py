@@ -0,0 +1,30 @@
+"""Проверки настроек posts при запуске (manage.py check)."""
+import sorl
+from django.core.checks import Error, register
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from . import thumbnails
+
+
+@register()
+def check_sorl_thumbnail(app_configs, **kwargs):
+    """posts.thumbnails повторяет внутренние расчёты sorl-thumbnail и
+    читает его хранилище ключей напрямую; это верно только для одной
+    версии sorl и хранилища cached_db."""
+    errors = []
+    if sorl.__version__ != thumbnails.SORL_VERSION:
+        errors.append(Error(
+            f'posts.thumbnails рассчитан на sorl-thumbnail '
+            f'{thumbnails.SORL_VERSION}, установлен {sorl.__version__}.',
+            hint='Проверьте prefetch и _thumbnail_name на новой версии '
+                 'и обновите SORL_VERSION.',
+            id='posts.E001',
+        ))
+    if sorl_settings.THUMBNAIL_KVSTORE != thumbnails.SORL_KVSTORE:
+        errors.append(Error(
+            f'posts.thumbnails читает хранилище ключей '
+            f'{thumbnails.SORL_KVSTORE}, а THUMBNAIL_KVSTORE = '
+            f'{sorl_settings.THUMBNAIL_KVSTORE}.',
+            id='posts.E002',
+        ))
+    return errors
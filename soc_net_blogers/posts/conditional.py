@@ -0,0 +1,87 @@
+"""Условные GET-запросы (ETag) для лент и страницы поста.
+
+Валидаторы строятся из версий тегов кэша, которые сбрасываются при
+каждой записи постов, комментариев и подписок (см. posts.signals),
+поэтому ответ 304 отдаётся без запроса ленты и рендеринга шаблонов.
+"""
+import hashlib
+
+from django.conf import settings
+from django.views.decorators.http import condition
+
+from core import cache_tags
+
+from .models import Group, Post, User
+
+
+def index_tags(request):
+    return ['feed:all']
+
+
+def group_tags(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    return None if group_id is None else [f'group:{group_id}']
+
+
+def profile_tags(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    return None if author_id is None else [f'author:{author_id}']
+
+
+def viewer_tags(request):
+    """Теги отложенных фрагментов, которые у каждого посетителя свои:
+    кнопка подписки зависит от его подписок."""
+    return [f'timeline:{request.user.pk}']
+
+
+def post_tags(request, post_id):
+    author_id = Post.objects.filter(pk=post_id).values_list(
+        'author_id', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    return [f'post:{post_id}', f'author:{author_id}']
+
+
+def page_tags(request, get_tags, kwargs):
+    """Теги страницы; вычисляются один раз на запрос.
+
+    get_tags(request, **kwargs) возвращает теги, от которых зависит
+    страница, или None, если страницы нет (тогда view отдаст 404).
+    """
+    if not hasattr(request, '_page_tags'):
+        request._page_tags = get_tags(request, **kwargs)
+    return request._page_tags
+
+
+def conditional_page(get_tags, get_viewer_tags=None):
+    """Декоратор view: ETag по тегам страницы.
+
+    get_viewer_tags(request) добавляет теги, от которых зависят только
+    отложенные фрагменты страницы: они входят в ETag, но не в ключ кэша
+    целой страницы (см. posts.page_cache).
+
+    Last-Modified не отдаётся: в HTTP он округляется до секунды, и
+    запись в ту же секунду, что и ответ, дала бы устаревший 304.
+    """
+    def etag(request, *args, **kwargs):
+        tags = page_tags(request, get_tags, kwargs)
+        if tags is None:
+            return None
+        if get_viewer_tags is not None:
+            tags = [*tags, *get_viewer_tags(request)]
+        # Страница содержит имя пользователя и CSRF-токен,
+        # поэтому валидатор у каждого пользователя свой.
+        parts = (
+            cache_tags.get_version(*tags),
+            request.get_full_path(),
+            str(request.user.pk),
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        )
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    return condition(etag_func=etag)
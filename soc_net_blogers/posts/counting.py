@@ -0,0 +1,71 @@
+"""Стратегии подсчёта записей для пагинатора лент.
+
+Стратегия — вызываемый объект ``counter(queryset) -> (count, exact)``:
+второе значение сообщает, точное ли число или это оценка.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+
+class ExactCount:
+    """Обычный SELECT COUNT(*) по всей выборке."""
+
+    def __call__(self, queryset):
+        return queryset.count(), True
+
+
+class EstimatedCount:
+    """Считает не больше limit записей, дальше — оценка.
+
+    Подсчёт ограничен подзапросом с LIMIT, поэтому никогда не сканирует
+    всю таблицу. Если записей больше limit, для выборки без фильтров
+    размер таблицы оценивается по максимальному id, а для выборки с
+    фильтрами возвращается сам limit как нижняя граница.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+
+    def __call__(self, queryset):
+        # Для подсчёта порядок и аннотации не нужны, а с ними SQLite
+        # сортировал бы или группировал выборку до LIMIT.
+        count = queryset.order_by().values('pk')[:self.limit].count()
+        if count < self.limit:
+            return count, True
+        if not queryset.query.where:
+            max_pk = queryset.aggregate(max_pk=Max('pk'))['max_pk']
+            return max(max_pk or 0, count), False
+        return count, False
+
+
+class CachedCount:
+    """Берёт результат другой стратегии из кэша на timeout секунд."""
+
+    key_prefix = 'feed_count'
+
+    def __init__(self, counter, timeout):
+        self.counter = counter
+        self.timeout = timeout
+
+    def get_key(self, queryset):
+        sql = str(queryset.order_by().query).encode()
+        return f'{self.key_prefix}:{hashlib.md5(sql).hexdigest()}'
+
+    def __call__(self, queryset):
+        key = self.get_key(queryset)
+        result = cache.get(key)
+        if result is None:
+            result = self.counter(queryset)
+            cache.set(key, result, self.timeout)
+        return result
+
+
+def get_default_counter():
+    """Стратегия по умолчанию для лент: кэш поверх ограниченного COUNT."""
+    return CachedCount(
+        EstimatedCount(settings.FEED_COUNT_LIMIT),
+        settings.FEED_COUNT_CACHE_TIMEOUT,
+    )
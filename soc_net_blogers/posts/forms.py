@@ -1,5 +1,7 @@
 from django import forms
+from django.core.exceptions import ValidationError
 
+from .images import process_upload
 from .models import Comment, Post
 
 
@@ -8,8 +10,59 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Уже сохранённую картинку повторно не обрабатываем.
+        if image and 'image' in self.changed_data:
+            return process_upload(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
         fields = ('text', )
+
+
+class CachedChoiceIterator(forms.models.ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for key, obj in self.field.get_objects().items():
+            yield key, self.field.label_from_instance(obj)
+
+    def __len__(self):
+        return (len(self.field.get_objects())
+                + (self.field.empty_label is not None))
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """Выбор объекта, варианты которого читаются из базы один раз.
+
+    Формы list_editable получают копии поля на каждую строку; копии
+    делят один кэш, поэтому список вариантов и проверка значения
+    не повторяют запрос для каждой строки.
+    """
+    iterator = CachedChoiceIterator
+
+    def __init__(self, *args, **kwargs):
+        self._cache = {}
+        super().__init__(*args, **kwargs)
+
+    def get_objects(self):
+        if 'objects' not in self._cache:
+            key = self.to_field_name or 'pk'
+            self._cache['objects'] = {
+                str(getattr(obj, key)): obj for obj in self.queryset
+            }
+        return self._cache['objects']
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.get_objects()[str(value)]
+        except KeyError:
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice'
+            )
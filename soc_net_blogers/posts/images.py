@@ -0,0 +1,175 @@
+"""Картинки постов: обработка загрузки, сведения о файле и удаление.
+
+Загруженный оригинал проверяется по заголовку (размеры без
+декодирования), слишком большие картинки отклоняются, остальные
+уменьшаются до POST_IMAGE_MAX_SIDE, теряют EXIF и пережимаются;
+GIF и анимации сохраняются как есть, если в них нет метаданных.
+JPEG декодируется сразу в уменьшенном масштабе, поэтому память
+ограничена размером уменьшенной картинки; PNG и WebP декодируются
+целиком, и для них действует меньший предел
+POST_IMAGE_MAX_DECODED_PIXELS.
+"""
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from PIL import Image, ImageOps
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from .models import Post
+from .storage import file_sha256, post_images
+
+logger = logging.getLogger(__name__)
+
+METADATA_FIELDS = (
+    'image_width', 'image_height', 'image_format', 'image_size',
+    'image_hash',
+)
+# Форматы, которые пережимаются. MPO (JPEG с дополнительными кадрами,
+# его пишут телефоны и стереокамеры) сохраняется как JPEG из основного
+# кадра.
+REENCODED_FORMATS = {
+    'JPEG': '.jpg',
+    'MPO': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+}
+# Форматы, которые сохраняются как есть: GIF и анимированные картинки.
+# Пересохранение оставило бы от анимации первый кадр, поэтому
+# картинки с EXIF или XMP в них не принимаются. Прочие форматы
+# (например, TIFF) отклоняются.
+KEPT_FORMATS = {'GIF', 'PNG', 'WEBP'}
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp')
+
+
+def _check_kept(image):
+    """Проверяет картинку, которая сохранится без пережатия."""
+    if image.format not in KEPT_FORMATS:
+        raise ValidationError(
+            'Поддерживаются картинки JPEG, PNG, WebP и GIF.'
+        )
+    if any(key in image.info for key in METADATA_KEYS):
+        raise ValidationError(
+            'Картинка содержит метаданные EXIF или XMP: '
+            'сохраните её без них.'
+        )
+
+
+def process_upload(uploaded):
+    """Проверяет, уменьшает и пережимает загруженную картинку.
+
+    Возвращает новый временный файл или uploaded, если пережимать
+    его не нужно. Слишком большие по числу пикселей картинки,
+    анимации с метаданными и прочие форматы отклоняются
+    с ValidationError.
+    """
+    uploaded.seek(0)
+    try:
+        image = Image.open(uploaded)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Не удалось прочитать картинку.')
+    with image:
+        width, height = image.size
+        image_format = image.format
+        jpeg = image_format in ('JPEG', 'MPO')
+        # Кадры MPO — не анимация: сохраняется основной.
+        reencoded = image_format in REENCODED_FORMATS and (
+            jpeg or not getattr(image, 'is_animated', False)
+        )
+        if not reencoded:
+            _check_kept(image)
+        max_pixels = settings.POST_IMAGE_MAX_PIXELS
+        if reencoded and not jpeg:
+            max_pixels = min(max_pixels,
+                             settings.POST_IMAGE_MAX_DECODED_PIXELS)
+        if width * height > max_pixels:
+            raise ValidationError(
+                f'Картинка {width}x{height} слишком велика: не больше '
+                f'{max_pixels / 10 ** 6:g} Мпикс.'
+            )
+        if not reencoded:
+            uploaded.seek(0)
+            return uploaded
+        max_side = settings.POST_IMAGE_MAX_SIDE
+        # JPEG декодируется сразу в уменьшенном масштабе.
+        image.draft('RGB', (max_side, max_side))
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        extension = REENCODED_FORMATS[image_format]
+        options = {'optimize': True}
+        if icc_profile:
+            options['icc_profile'] = icc_profile
+        if jpeg:
+            image_format = 'JPEG'
+            image = image.convert('RGB')
+            options.update(quality=settings.POST_IMAGE_QUALITY,
+                           progressive=True)
+        elif image_format == 'WEBP':
+            options.update(quality=settings.POST_IMAGE_QUALITY, method=4)
+        name = os.path.splitext(os.path.basename(uploaded.name))[0]
+        # Как и загрузка, результат уходит на диск, если он больше
+        # FILE_UPLOAD_MAX_MEMORY_SIZE.
+        result = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        # EXIF не передаётся, поэтому в новый файл он не попадает.
+        image.save(result, image_format, **options)
+        image.close()
+    result.seek(0)
+    return File(result, name=name + extension)
+
+
+def read_metadata(image_file):
+    """Значения полей METADATA_FIELDS для открытого файла картинки."""
+    digest = file_sha256(image_file)
+    # Pillow читает только заголовок, без декодирования картинки.
+    with Image.open(image_file) as image:
+        width, height = image.size
+        image_format = image.format or ''
+    image_file.seek(0)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_format': image_format,
+        'image_size': image_file.size,
+        'image_hash': digest,
+    }
+
+
+def update_metadata(post):
+    """Записывает в пост сведения о его картинке (не сохраняя пост)."""
+    if post.image:
+        metadata = read_metadata(post.image)
+    else:
+        metadata = dict.fromkeys(METADATA_FIELDS)
+        metadata.update(image_format='', image_hash='')
+    for field, value in metadata.items():
+        setattr(post, field, value)
+
+
+def release(name):
+    """Удаляет файл картинки с миниатюрами, если он больше не нужен.
+
+    Файл общий для всех постов с такой же картинкой, поэтому число
+    ссылающихся на него постов и есть счётчик ссылок.
+    """
+    if not name:
+        return
+    with post_images.lock(name):
+        if not Post.objects.filter(image=name).exists():
+            delete_thumbnails(ImageFile(name, post_images))
+
+
+def release_many(names):
+    """release для каждого имени; ошибка с одним файлом не мешает
+    остальным."""
+    for name in names:
+        try:
+            release(name)
+        except Exception:
+            logger.exception('Не удалось удалить картинку %s', name)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import cache_tags
+from posts import images
+from posts.models import Post
+from posts.signals import post_tags
+from posts.storage import is_content_name, post_images
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в хранилище по содержимому: '
+            'одинаковые файлы сливаются в один, копии удаляются.')
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image='').order_by().values_list(
+            'image', flat=True
+        ).distinct()
+        moved = removed = 0
+        for name in [name for name in names if not is_content_name(name)]:
+            try:
+                with post_images.open(name) as image_file:
+                    new_name = post_images.save(name, image_file)
+            except OSError as error:
+                self.stderr.write(f'{name}: {error}')
+                continue
+            with transaction.atomic():
+                posts = Post.objects.filter(image=name)
+                tags = set()
+                for row in posts.values_list('pk', 'author_id', 'group_id'):
+                    tags |= post_tags(*row)
+                moved += posts.update(image=new_name,
+                                      updated=timezone.now())
+            cache_tags.invalidate(*tags)
+            images.release(name)
+            removed += 1
+        self.stdout.write(
+            f'Перенесено ссылок: {moved}, удалено файлов: {removed}.'
+        )
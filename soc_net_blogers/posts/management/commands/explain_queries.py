@@ -0,0 +1,118 @@
+import re
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import urls as posts_urls
+from posts.models import Follow, Group, Post
+
+# Проход по всей таблице или всему индексу. Подзапросы и виртуальные
+# таблицы FTS5 (они ищут по своему индексу, хотя план и называет это
+# SCAN) не в счёт. Проход по индексу без условий — это лента в порядке
+# индекса, которую обрывает LIMIT; с условием WHERE он читает лишнее.
+FULL_SCAN = re.compile(
+    r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX .*)?$'
+)
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+# Таблицы, которые страницы читают целиком намеренно: список групп
+# в форме поста.
+FULL_READS = {'posts_group'}
+# Параметры запроса для страниц, которым без них нечего искать.
+URL_PARAMS = {
+    'posts:search': {'q': 'пост'},
+}
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'explain_queries',
+    }
+}
+
+
+class Command(BaseCommand):
+    help = ('Открывает страницы posts, выполняет EXPLAIN QUERY PLAN '
+            'для каждого их запроса и завершается с ошибкой, если план '
+            'читает таблицу целиком или сортирует во временном B-дереве.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ignore', action='append', default=[], metavar='REGEX',
+            help='Не считать ошибкой строки плана, подходящие под REGEX.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN есть только в SQLite.')
+        ignored = [re.compile(pattern) for pattern in options['ignore']]
+        follow = Follow.objects.select_related('user', 'author').first()
+        post = Post.objects.select_related('author').first()
+        group = Group.objects.first()
+        if not (follow and post and group):
+            raise CommandError('Нужны хотя бы одна группа, пост и подписка.')
+        url_kwargs = {
+            'slug': group.slug,
+            'username': follow.author.username,
+            'post_id': post.pk,
+        }
+        tables = set(connection.introspection.table_names())
+        problems = []
+        # Кэш подменён, иначе страницы отдавались бы без запросов;
+        # всё, что страницы запишут в базу, откатывается.
+        with override_settings(CACHES=TEST_CACHES, DEBUG=False,
+                               ALLOWED_HOSTS=['testserver']), \
+                transaction.atomic():
+            client = Client()
+            client.force_login(follow.user)
+            for name, url in self.get_urls(url_kwargs):
+                cache.clear()
+                with CaptureQueriesContext(connection) as context:
+                    client.get(url, URL_PARAMS.get(name))
+                for query in context.captured_queries:
+                    problems.extend(
+                        (name, query['sql'], detail)
+                        for detail in self.check(query['sql'], tables)
+                        if not any(
+                            pattern.search(detail) for pattern in ignored
+                        )
+                    )
+            transaction.set_rollback(True)
+        for name, sql, detail in problems:
+            self.stderr.write(f'{name}: {detail}\n    {sql}')
+        if problems:
+            raise CommandError(f'Планов без подходящего индекса: '
+                               f'{len(problems)}.')
+        self.stdout.write('Все запросы страниц posts используют индексы.')
+
+    @staticmethod
+    def get_urls(url_kwargs):
+        for pattern in posts_urls.urlpatterns:
+            if not pattern.name:
+                continue
+            name = f'{posts_urls.app_name}:{pattern.name}'
+            kwargs = {key: url_kwargs[key]
+                      for key in pattern.pattern.converters}
+            yield name, reverse(name, kwargs=kwargs)
+
+    @staticmethod
+    def check(sql, tables):
+        """Строки плана SELECT-запроса, в которых нет нужного индекса."""
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        # Ранжирование поиска сортирует только найденные записи.
+        sorts_matches = ' MATCH ' in sql
+        problems = []
+        for detail in plan:
+            scan = FULL_SCAN.match(detail)
+            if scan and scan[1] in tables - FULL_READS:
+                if not scan[2] or ' WHERE ' in sql:
+                    problems.append(detail)
+            elif TEMP_SORT.search(detail) and not sorts_matches:
+                problems.append(detail)
+        return problems
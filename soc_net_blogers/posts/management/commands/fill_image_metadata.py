@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from posts import images
+from posts.models import Post
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Записывает размеры, формат, объём и хэш картинок постов, '
+            'загруженных до появления этих полей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать сведения и для уже заполненных постов.'
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').only(
+            'image', *images.METADATA_FIELDS
+        )
+        if not options['all']:
+            posts = posts.filter(image_hash='')
+        batch = []
+        updated = missing = 0
+        for post in posts.iterator():
+            try:
+                with post.image.open('rb'):
+                    images.update_metadata(post)
+            except (OSError, ValueError) as error:
+                missing += 1
+                self.stderr.write(f'{post.image.name}: {error}')
+                continue
+            batch.append(post)
+            if len(batch) >= BATCH_SIZE:
+                updated += self.save(batch)
+        updated += self.save(batch)
+        self.stdout.write(
+            f'Сведения записаны для {updated} картинок, '
+            f'не прочитано: {missing}.'
+        )
+
+    @staticmethod
+    def save(batch):
+        # bulk_update не отправляет сигналов: страницы от этих полей
+        # не зависят, и сбрасывать их кэш незачем.
+        Post.objects.bulk_update(batch, images.METADATA_FIELDS)
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,32 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры картинок всех постов на нескольких ядрах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; по умолчанию — по числу ядер.'
+        )
+
+    def handle(self, *args, **options):
+        images = dict(
+            Post.objects.exclude(image='').order_by().values_list(
+                'image', 'image_width'
+            )
+        )
+        # Дочерние процессы не должны наследовать открытые соединения.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for _ in pool.map(thumbnails.generate, images.keys(),
+                              images.values(), chunksize=16):
+                pass
+        self.stdout.write(f'Миниатюры построены для {len(images)} картинок.')
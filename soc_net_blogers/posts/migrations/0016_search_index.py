@@ -0,0 +1,38 @@
+from django.db import migrations
+
+TABLES = {
+    'posts_post': 'posts_post_fts',
+    'posts_comment': 'posts_comment_fts',
+}
+
+
+def create_index(apps, schema_editor):
+    # FTS5 есть только в SQLite, на других базах поиск отключён.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for source, table in TABLES.items():
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {table} USING fts5('
+            f"text, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO {table} (rowid, text) SELECT id, text FROM {source}'
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES.values():
+        schema_editor.execute(f'DROP TABLE {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_auto_20261018_0549'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def fill_timelines(apps, schema_editor):
+    """Собирает ленты подписок, как команда rebuild_timelines: записи
+    ленты появились в 0011, а подписки и посты уже были."""
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    UserStats = apps.get_model('posts', 'UserStats')
+    celebrities = list(UserStats.objects.filter(
+        followers_count__gte=settings.TIMELINE_CELEBRITY_FOLLOWERS
+    ).values_list('user_id', flat=True))
+    readers = list(Follow.objects.order_by().values_list(
+        'user_id', flat=True
+    ).distinct())
+    for user_id in readers:
+        authors = Follow.objects.filter(user_id=user_id).exclude(
+            author_id__in=celebrities
+        ).values('author_id')
+        posts = Post.objects.filter(author_id__in=authors).order_by(
+            '-pub_date', '-pk'
+        ).values_list('pk', 'pub_date')[:settings.TIMELINE_LENGTH]
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=user_id, post_id=post_id,
+                              pub_date=pub_date)
+                for post_id, pub_date in posts
+            ],
+            batch_size=settings.TIMELINE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
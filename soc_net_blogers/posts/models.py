@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .storage import post_images
+
 User = get_user_model()
 
 
@@ -17,6 +19,20 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты с полями, которые нужны карточке поста в лентах.
+
+        Автор и группа подгружаются тем же запросом, поэтому вывод
+        страницы не делает отдельных запросов на каждую карточку.
+        """
+        return self.select_related('author', 'group').only(
+            'text', 'pub_date', 'updated', 'image', 'image_width',
+            'author', 'group', 'author__username', 'author__first_name',
+            'author__last_name', 'group__title', 'group__slug',
+        )
+
+
 class Post(models.Model):
     text = models.TextField('Текст', help_text='Текст нового поста')
     pub_date = models.DateTimeField(
@@ -24,11 +40,14 @@ class Post(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
+    # Индексы по автору и группе — начала составных индексов в Meta.
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
         on_delete=models.CASCADE,
-        related_name='posts'
+        related_name='posts',
+        db_index=False,
     )
     group = models.ForeignKey(
         Group,
@@ -37,18 +56,59 @@ class Post(models.Model):
         blank=True,
         null=True,
         related_name='group',
-        help_text='Группа, к которой будет относиться пост'
+        help_text='Группа, к которой будет относиться пост',
+        db_index=False,
     )
+    # Одинаковые картинки хранятся одним файлом, см. posts.storage.
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
-        blank=True
+        storage=post_images,
+        blank=True,
+        db_index=True
+    )
+    # Сведения о картинке записываются при загрузке (см. posts.images),
+    # чтобы вывод страниц и миниатюры не открывали оригинал.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, editable=False
     )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', null=True, editable=False
+    )
+    image_format = models.CharField(
+        'Формат картинки', max_length=10, blank=True, editable=False
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер картинки, байт', null=True, editable=False
+    )
+    image_hash = models.CharField(
+        'SHA-256 картинки', max_length=64, blank=True, db_index=True,
+        editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Публикация'
         verbose_name_plural = 'Публикации'
         ordering = ('-pub_date',)
+        # Ленты автора и группы читаются одним диапазоном индекса,
+        # уже в порядке вывода (обратный проход даёт и id по убыванию).
+        indexes = [
+            models.Index(
+                fields=['author', 'pub_date'],
+                name='post_author_pub_date',
+            ),
+            models.Index(
+                fields=['group', 'pub_date'],
+                name='post_group_pub_date',
+            ),
+        ]
 
     def __str__(self) -> str:
         return (f'{self.group}, '
@@ -58,11 +118,13 @@ class Post(models.Model):
 
 
 class Comment(models.Model):
+    # Индекс по посту — начало индекса comment_post_created.
     post = models.ForeignKey(
         Post,
         verbose_name='Пост',
         on_delete=models.CASCADE,
         related_name='comments',
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
@@ -71,12 +133,20 @@ class Comment(models.Model):
         related_name='comments'
     )
     text = models.TextField('Текст', help_text='Текст комментария')
-    created = models.DateTimeField('Дата публикации', auto_now_add=True)
+    created = models.DateTimeField(
+        'Дата публикации', auto_now_add=True, db_index=True
+    )
 
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ('-created',)
+        indexes = [
+            models.Index(
+                fields=['post', '-created'],
+                name='comment_post_created',
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'Комментарий от {self.author.username}: {self.text[:15]}'
@@ -89,11 +159,13 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='follower'
     )
+    # Индекс по автору — начало индекса follow_author_user.
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
         on_delete=models.CASCADE,
-        related_name='following'
+        related_name='following',
+        db_index=False,
     )
 
     class Meta:
@@ -109,7 +181,83 @@ class Follow(models.Model):
                 name='Запрет подписки на самого себя'
             )
         ]
+        # Подписчики автора: уникальный индекс начинается с user.
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user',
+            ),
+        ]
 
     def __str__(self) -> str:
         return (f'Пользователь {self.user.username} подписан '
                 f'на автора {self.author.username}')
+
+
+class UserStats(models.Model):
+    """Хранимые счётчики пользователя.
+
+    Поддерживаются сигналами при создании и удалении постов и подписок;
+    разошедшиеся значения пересчитывает команда rebuild_counters.
+    """
+    user = models.OneToOneField(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков',
+        default=0,
+        db_index=True
+    )
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self) -> str:
+        return f'Счётчики пользователя {self.user_id}'
+
+
+class TimelineEntry(models.Model):
+    """Запись в ленте подписок пользователя.
+
+    Заполняется при публикации поста для каждого подписчика автора,
+    чтобы лента подписок читалась из одного диапазона индекса.
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name='Читатель',
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        verbose_name='Пост',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='Уникальная запись ленты',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'Лента {self.user_id}: пост {self.post_id}'
@@ -0,0 +1,56 @@
+"""Кэш целых страниц лент и постов.
+
+Всё, что зависит от посетителя (шапка, переключатель лент, форма
+комментария, кнопки подписки и редактирования), вынесено в отложенные
+фрагменты (см. core.late_render), поэтому страница с метками одинакова
+для всех. Готовый HTML хранится в кэше по пути с параметрами запроса и
+версии тегов страницы (см. posts.conditional): запись поста,
+комментария или подписки сбрасывает тег, и следующий посетитель
+получает свежую страницу. Метки заполняет LateRenderMiddleware уже
+после кэша, так что каждый видит свои фрагменты.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from core import cache_tags
+
+from .conditional import page_tags
+
+KEY_PREFIX = 'page'
+
+
+def page_key(request, tags):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'{KEY_PREFIX}:{path}:{cache_tags.get_version(*tags)}'
+
+
+def cache_whole_page(get_tags):
+    """Декоратор view: отдаёт страницу из кэша."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            tags = page_tags(request, get_tags, kwargs)
+            if tags is None:
+                return view(request, *args, **kwargs)
+            key = page_key(request, tags)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            response = view(request, *args, **kwargs)
+            # Страницы с куками или ошибками не кэшируются.
+            if response.status_code == 200 and not response.cookies:
+                cache.set(
+                    key,
+                    (response.content, response['Content-Type']),
+                    settings.PAGE_CACHE_TIMEOUT,
+                )
+            return response
+        return wrapper
+    return decorator
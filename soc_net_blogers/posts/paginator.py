@@ -0,0 +1,373 @@
+"""Постраничный вывод лент публикаций.
+
+Основной способ листания — курсор по ключу ``(pub_date, id)``: следующая
+страница выбирается условием «старше последней показанной записи», поэтому
+глубина листания не влияет на стоимость запроса. Старые ссылки вида
+``?page=N`` продолжают работать через LIMIT/OFFSET.
+
+Лента может состоять из нескольких выборок (например, разложенные по
+подпискам посты и посты популярных авторов): они сливаются k-way merge
+по тому же ключу.
+"""
+import base64
+import binascii
+import heapq
+import json
+from collections.abc import Sequence
+from functools import reduce
+from math import ceil
+from operator import or_
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from .counting import ExactCount, get_default_counter
+
+NEXT = 'n'
+PREVIOUS = 'p'
+ELLIPSIS = '…'
+
+
+def encode_cursor(direction, number, post):
+    """Непрозрачный токен для ссылки на соседнюю страницу."""
+    payload = json.dumps(
+        [direction, number, post.pub_date.isoformat(), post.pk]
+    )
+    token = base64.urlsafe_b64encode(payload.encode())
+    return token.decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разбирает токен в (direction, number, pub_date, pk).
+
+    Для испорченного или подделанного токена возвращает None.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, number, pub_date, pk = json.loads(
+            base64.urlsafe_b64decode(padded.encode())
+        )
+        pub_date = parse_datetime(pub_date)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        return None
+    if (direction not in (NEXT, PREVIOUS) or pub_date is None
+            or not isinstance(number, int) or not isinstance(pk, int)):
+        return None
+    return direction, max(number, 1), pub_date, pk
+
+
+def key_fields(queryset):
+    """Поля ключа (дата, id), по которым листается выборка.
+
+    Выборка может задать ключ аннотациями feed_date и feed_pk с теми же
+    значениями из другой таблицы (например, записей ленты подписок),
+    чтобы сортировка и условие курсора читали индекс этой таблицы.
+    """
+    if 'feed_date' in queryset.query.annotations:
+        return 'feed_date', 'feed_pk'
+    return 'pub_date', 'pk'
+
+
+def _beyond(queryset, pub_date, pk, reverse):
+    """Условие «после записи (pub_date, pk)» в порядке выборки."""
+    date_field, pk_field = key_fields(queryset)
+    lookup = 'gt' if reverse else 'lt'
+    return queryset.filter(
+        Q(**{f'{date_field}__{lookup}': pub_date})
+        | Q(**{date_field: pub_date, f'{pk_field}__{lookup}': pk})
+    )
+
+
+class FeedPage(Sequence):
+    """Страница ленты с интерфейсом, совместимым с django.core.paginator.Page.
+
+    Помимо номеров страниц отдаёт курсоры ``next_cursor`` и
+    ``previous_cursor`` для ссылок на соседние страницы.
+    """
+
+    def __init__(self, object_list, number, paginator,
+                 has_next, has_previous, cursor=''):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.cursor = cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<FeedPage {self.number}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    @cached_property
+    def page_links(self):
+        """Номера страниц для навигации с пропусками ELLIPSIS."""
+        return list(self.paginator.get_elided_page_range(self.number))
+
+    @cached_property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return ''
+        return encode_cursor(NEXT, self.number + 1, self.object_list[-1])
+
+    @cached_property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return ''
+        return encode_cursor(PREVIOUS, self.number - 1, self.object_list[0])
+
+
+class FeedPaginator:
+    """Пагинатор ленты публикаций, упорядоченной по (pub_date, id).
+
+    object_list — выборка или список выборок, которые сливаются в одну
+    ленту без повторов.
+    """
+
+    # Сколько номеров страниц показывать вокруг текущей и по краям.
+    on_each_side = 2
+    on_ends = 1
+
+    def __init__(self, object_list, per_page, counter=None):
+        if not isinstance(object_list, (list, tuple)):
+            object_list = [object_list]
+        self.streams = [
+            qs.order_by(*(f'-{field}' for field in key_fields(qs)))
+            for qs in object_list
+        ]
+        self.per_page = per_page
+        self.counter = counter or ExactCount()
+
+    @cached_property
+    def _count(self):
+        queryset = self.streams[0]
+        if len(self.streams) > 1:
+            # Пост может попасть сразу в несколько выборок, поэтому
+            # считается их объединение; id ищутся по индексам выборок.
+            queryset = queryset.model.objects.filter(reduce(or_, (
+                Q(pk__in=stream.values('pk')) for stream in self.streams
+            )))
+        return self.counter(queryset)
+
+    @property
+    def count(self):
+        return self._count[0]
+
+    @property
+    def count_is_exact(self):
+        """False, если число записей — оценка стратегии подсчёта."""
+        return self._count[1]
+
+    @cached_property
+    def num_pages(self):
+        return max(ceil(self.count / self.per_page), 1)
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    def get_elided_page_range(self, number=1):
+        """Окно номеров: первые, последние и соседние с текущей.
+
+        Число элементов не зависит от количества страниц, поэтому шаблон
+        навигации рендерится за постоянное время. Если число страниц
+        только оценено, последние номера не показываются.
+        """
+        num_pages = self.num_pages
+        if self.count_is_exact:
+            number = min(number, num_pages)
+            on_ends = self.on_ends
+        else:
+            num_pages = max(num_pages, number)
+            on_ends = 0
+        window_start = max(number - self.on_each_side, 1)
+        window_end = min(number + self.on_each_side, num_pages)
+        if window_start > self.on_ends + 1:
+            yield from range(1, self.on_ends + 1)
+            yield ELLIPSIS
+        else:
+            window_start = 1
+        if window_end < num_pages - on_ends:
+            yield from range(window_start, window_end + 1)
+            yield ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(window_start, num_pages + 1)
+
+    def _fetch(self, limit, key=None, reverse=False):
+        """Первые limit записей слияния всех выборок после ключа key."""
+        streams = self.streams
+        if key is not None:
+            streams = [_beyond(stream, *key, reverse) for stream in streams]
+        if reverse:
+            streams = [stream.reverse() for stream in streams]
+        if len(streams) == 1:
+            return list(streams[0][:limit])
+        merged = heapq.merge(
+            *(stream[:limit] for stream in streams),
+            key=lambda post: (post.pub_date, post.pk),
+            reverse=not reverse,
+        )
+        items = []
+        seen = set()
+        for post in merged:
+            if post.pk not in seen:
+                seen.add(post.pk)
+                items.append(post)
+            if len(items) == limit:
+                break
+        return items
+
+    def _build_page(self, items, number, has_previous, cursor=''):
+        return FeedPage(
+            items[:self.per_page], number, self,
+            has_next=len(items) > self.per_page,
+            has_previous=has_previous,
+            cursor=cursor,
+        )
+
+    def page(self, number):
+        """Страница по номеру через OFFSET — для старых ссылок ?page=N."""
+        bottom = (number - 1) * self.per_page
+        if len(self.streams) == 1:
+            items = list(
+                self.streams[0][bottom:bottom + self.per_page + 1]
+            )
+        else:
+            items = self._fetch(bottom + self.per_page + 1)[bottom:]
+        return self._build_page(items, number, has_previous=number > 1)
+
+    def page_after(self, pub_date, pk, number, cursor=''):
+        """Страница записей, опубликованных раньше записи (pub_date, pk)."""
+        items = self._fetch(self.per_page + 1, (pub_date, pk))
+        return self._build_page(items, number, True, cursor)
+
+    def page_before(self, pub_date, pk, number, cursor=''):
+        """Страница записей, опубликованных позже записи (pub_date, pk)."""
+        items = self._fetch(self.per_page + 1, (pub_date, pk),
+                            reverse=True)
+        return FeedPage(
+            items[:self.per_page][::-1], number, self,
+            has_next=True,
+            has_previous=len(items) > self.per_page,
+            cursor=cursor,
+        )
+
+    def get_page(self, number=None, cursor=None):
+        """Как Paginator.get_page: при ошибочных параметрах не падает."""
+        decoded = decode_cursor(cursor) if cursor else None
+        if decoded is not None:
+            direction, number, pub_date, pk = decoded
+            if direction == NEXT:
+                return self.page_after(pub_date, pk, number, cursor)
+            return self.page_before(pub_date, pk, number, cursor)
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        page = self.page(number)
+        if not page and number > 1:
+            return self.page(self.num_pages)
+        return page
+
+
+class DeferredJoinPaginator(Paginator):
+    """Пагинатор списков админки для больших таблиц.
+
+    Число записей берётся из стратегии подсчёта (по умолчанию — оценка
+    с кэшем). Страница выбирается в два шага: сначала LIMIT/OFFSET
+    пробегает только по id, затем полные строки читаются по этим id,
+    поэтому глубокое смещение не тащит через сортировку целые записи.
+    Страница остаётся QuerySet'ом, как того требуют формы list_editable.
+
+    Если число записей только оценено, оно может оказаться и меньше, и
+    больше настоящего. Тогда отдаётся страница с любым номером, а
+    список заканчивается первой неполной или пустой страницей.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True, counter=None):
+        super().__init__(object_list, per_page, orphans,
+                         allow_empty_first_page)
+        self.counter = counter or get_default_counter()
+        # Последняя страница, о которой известно, что она существует.
+        self._last_page = 1
+
+    @cached_property
+    def _count(self):
+        return self.counter(self.object_list)
+
+    @property
+    def count(self):
+        return self._count[0]
+
+    @property
+    def count_is_exact(self):
+        """False, если число записей — оценка стратегии подсчёта."""
+        return self._count[1]
+
+    @property
+    def num_pages(self):
+        hits = max(1, self.count - self.orphans)
+        num_pages = ceil(hits / self.per_page)
+        if self.count_is_exact:
+            return num_pages
+        return max(num_pages, self._last_page)
+
+    def validate_number(self, number):
+        if self.count_is_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        ids = list(self.object_list.values_list('pk', flat=True)[
+            bottom:bottom + self.per_page
+        ])
+        if not self.count_is_exact:
+            # За полной страницей может быть следующая.
+            full = len(ids) == self.per_page
+            self._last_page = number + 1 if full else number
+        return self._get_page(
+            self.object_list.filter(pk__in=ids), number, self
+        )
+
+
+def paginate(request, object_list):
+    """Страница ленты по параметрам ``?cursor=`` или ``?page=`` запроса."""
+    paginator = FeedPaginator(
+        object_list, settings.AMOUNT_PAGES, get_default_counter()
+    )
+    return paginator.get_page(
+        request.GET.get('page'), request.GET.get('cursor')
+    )
@@ -0,0 +1,164 @@
+"""Полнотекстовый поиск по постам и комментариям на SQLite FTS5.
+
+Тексты постов и комментариев копируются в виртуальные таблицы
+posts_post_fts и posts_comment_fts (rowid — id записи). Индекс
+обновляется сигналами при каждом сохранении и удалении, а команда
+rebuild_search_index пересобирает его целиком после массовых
+изменений в обход моделей (update, bulk_create).
+
+Результаты упорядочены по релевантности bm25, совпадение в тексте
+поста весит вдвое больше совпадения в комментарии. Страницы
+листаются курсором по ключу ``(релевантность, id)``, как и ленты.
+"""
+import base64
+import binascii
+import json
+import re
+
+from django.db import connection
+
+TABLES = {
+    'posts_post': 'posts_post_fts',
+    'posts_comment': 'posts_comment_fts',
+}
+# Совпадение в тексте поста важнее совпадения в комментарии.
+POST_WEIGHT = 2.0
+MAX_TERMS = 10
+
+RANKED_POSTS = f'''
+    SELECT post_id, MIN(score) AS score FROM (
+        SELECT rowid AS post_id,
+               bm25(posts_post_fts) * {POST_WEIGHT} AS score
+        FROM posts_post_fts WHERE posts_post_fts MATCH %s
+        UNION ALL
+        SELECT comment.post_id, bm25(posts_comment_fts)
+        FROM posts_comment_fts
+        JOIN posts_comment AS comment
+          ON comment.id = posts_comment_fts.rowid
+        WHERE posts_comment_fts MATCH %s
+    ) GROUP BY post_id
+'''
+
+
+def enabled():
+    """FTS5 есть только в SQLite; на других базах поиск отключён."""
+    return connection.vendor == 'sqlite'
+
+
+def to_match(query):
+    """Безопасное выражение MATCH из строки пользователя.
+
+    Каждое слово ищется как префикс, все слова обязательны; синтаксис
+    FTS5 (кавычки, операторы, скобки) из ввода не попадает в запрос.
+    """
+    terms = re.findall(r'\w+', query)[:MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def index(instance):
+    """Добавляет или обновляет запись instance в индексе."""
+    table = TABLES[instance._meta.db_table]
+    if enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE rowid = %s',
+                           [instance.pk])
+            cursor.execute(
+                f'INSERT INTO {table} (rowid, text) VALUES (%s, %s)',
+                [instance.pk, instance.text],
+            )
+
+
+def unindex(instance):
+    """Удаляет запись instance из индекса."""
+    table = TABLES[instance._meta.db_table]
+    if enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE rowid = %s',
+                           [instance.pk])
+
+
+def unindex_queryset(queryset):
+    """Удаляет из индекса все записи queryset одним запросом."""
+    table = TABLES[queryset.model._meta.db_table]
+    if enabled():
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE rowid IN ({sql})',
+                           params)
+
+
+def rebuild():
+    """Заново заполняет индекс из таблиц постов и комментариев."""
+    with connection.cursor() as cursor:
+        for source, table in TABLES.items():
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(
+                f'INSERT INTO {table} (rowid, text) '
+                f'SELECT id, text FROM {source}'
+            )
+            cursor.execute(f"INSERT INTO {table} ({table}) "
+                           f"VALUES ('optimize')")
+
+
+def filter_queryset(queryset, query):
+    """queryset, сужённый до записей с совпадением в тексте.
+
+    Для поиска в админке: один подзапрос к индексу вместо
+    LIKE '%…%' по всей таблице.
+    """
+    match = to_match(query)
+    if not match:
+        return queryset
+    source = queryset.model._meta.db_table
+    table = TABLES[source]
+    # RawSQL в pk__in попал бы в двойные скобки, и SQLite принял бы
+    # подзапрос за одно значение.
+    return queryset.extra(
+        where=[f'"{source}"."id" IN '
+               f'(SELECT rowid FROM {table} WHERE {table} MATCH %s)'],
+        params=[match],
+    )
+
+
+def encode_cursor(score, pk):
+    payload = json.dumps([score, pk]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(score, pk) из курсора или None для испорченного курсора."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        return None
+    if not isinstance(score, (int, float)) or not isinstance(pk, int):
+        return None
+    return score, pk
+
+
+def search_posts(query, limit, cursor=''):
+    """Самые релевантные посты после курсора.
+
+    Возвращает (список (id поста, score), курсор следующей страницы
+    или None).
+    """
+    match = to_match(query)
+    if not match or not enabled():
+        return [], None
+    sql = f'SELECT post_id, score FROM ({RANKED_POSTS})'
+    params = [match, match]
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        sql += ' WHERE (score, post_id) > (%s, %s)'
+        params += list(after)
+    sql += ' ORDER BY score, post_id LIMIT %s'
+    params.append(limit + 1)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return rows, next_cursor
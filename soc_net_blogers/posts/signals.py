@@ -0,0 +1,173 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from core import cache_tags
+
+from . import counters, images, search, timeline
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .storage import post_images
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    """Заводит счётчики нового пользователя; после правки профиля
+    сбрасывает страницы и карточки с его именем."""
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    # Вход пользователя сохраняет только last_login: его нигде не видно.
+    elif update_fields != frozenset({'last_login'}):
+        # Имя автора видно в карточках его постов на страницах групп,
+        # имя комментатора — на страницах прокомментированных постов.
+        group_ids = Post.objects.filter(
+            author=instance, group__isnull=False
+        ).order_by().values_list('group_id', flat=True).distinct()
+        post_ids = Comment.objects.filter(author=instance).order_by(
+        ).values_list('post_id', flat=True).distinct()
+        invalidate_after_commit(
+            'feed:all', f'author:{instance.pk}',
+            *(f'group:{group_id}' for group_id in group_ids),
+            *(f'post:{post_id}' for post_id in post_ids),
+        )
+
+
+def group_tags(group):
+    """Теги страниц, на которых видна группа: её лента, общая лента и
+    страницы авторов её постов (а через них и страницы постов)."""
+    authors = Post.objects.filter(group=group).order_by().values_list(
+        'author_id', flat=True
+    ).distinct()
+    return ['feed:all', f'group:{group.pk}',
+            *(f'author:{author_id}' for author_id in authors)]
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    """Сбрасывает страницы и карточки постов изменённой группы."""
+    if not created:
+        invalidate_after_commit(*group_tags(instance))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    """Сбрасывает страницы со ссылками на удаляемую группу.
+
+    Посты отвязываются от неё через update() без сигналов, поэтому
+    теги собираются до удаления, пока посты ещё в группе.
+    """
+    invalidate_after_commit(*group_tags(instance))
+
+
+def invalidate_after_commit(*tags):
+    """Сбрасывает теги после коммита: иначе страницу, прочитанную до
+    коммита, закэшировали бы под новой версией тегов."""
+    transaction.on_commit(lambda: cache_tags.invalidate(*tags))
+
+
+def post_tags(pk, author_id, group_id):
+    """Теги страниц, на которых виден пост."""
+    tags = {'feed:all', f'author:{author_id}', f'post:{pk}'}
+    if group_id is not None:
+        tags.add(f'group:{group_id}')
+    return tags
+
+
+def invalidate_post(post):
+    """Сбрасывает кэш всех страниц, на которых виден пост."""
+    tags = post_tags(post.pk, post.author_id, post.group_id)
+    saved_group_id = getattr(post, '_saved_group_id', None)
+    if saved_group_id is not None:
+        tags.add(f'group:{saved_group_id}')
+    invalidate_after_commit(*tags)
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+    """Запоминает прежние группу и картинку: страницы прежней группы
+    нужно сбросить, а картинку — удалить, если она больше не нужна."""
+    if instance.pk:
+        instance._saved_group_id, instance._saved_image = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'image'
+            ).first() or (None, '')
+        )
+
+
+@receiver(pre_save, sender=Post)
+def post_image_saving(sender, instance, **kwargs):
+    """Записывает сведения о новой или удалённой картинке поста."""
+    image = instance.image
+    # Ещё не сохранённый в хранилище файл — это только что загруженный.
+    if (image and not image._committed) or (
+        not image and instance.image_hash
+    ):
+        images.update_metadata(instance)
+    instance._image_uploaded = bool(image and not image._committed)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    """Раскладывает новый пост по лентам подписчиков."""
+    if created:
+        counters.change_user(instance.author_id, posts_count=1)
+        timeline.fan_out(instance)
+    search.index(instance)
+    invalidate_post(instance)
+    if getattr(instance, '_image_uploaded', False):
+        # Пока пост не закоммичен, release не видит его и может удалить
+        # общий файл; ссылка сохранит содержимое до коммита.
+        name = instance.image.name
+        pinned = post_images.pin(name)
+        transaction.on_commit(
+            lambda: post_images.unpin(name, pinned)
+        )
+    saved_image = getattr(instance, '_saved_image', '')
+    if saved_image and saved_image != instance.image.name:
+        transaction.on_commit(lambda: images.release(saved_image))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user(instance.author_id, posts_count=-1)
+    search.unindex(instance)
+    invalidate_post(instance)
+    image = instance.image.name
+    if image:
+        transaction.on_commit(lambda: images.release(image))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_post(instance.post_id, 1)
+    search.index(instance)
+    invalidate_after_commit(f'post:{instance.post_id}')
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_post(instance.post_id, -1)
+    search.unindex(instance)
+    invalidate_after_commit(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    """Добавляет посты автора в ленту нового подписчика."""
+    if created:
+        counters.change_user(instance.author_id, followers_count=1)
+        counters.change_user(instance.user_id, following_count=1)
+        timeline.backfill(instance.user, instance.author)
+        timeline.followers_changed(instance.author_id, 1)
+        invalidate_after_commit(f'timeline:{instance.user_id}')
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Убирает посты автора из ленты отписавшегося."""
+    counters.change_user(instance.author_id, followers_count=-1)
+    counters.change_user(instance.user_id, following_count=-1)
+    timeline.followers_changed(instance.author_id, -1)
+    timeline.remove(instance.user, instance.author)
+    invalidate_after_commit(f'timeline:{instance.user_id}')
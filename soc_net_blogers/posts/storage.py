@@ -0,0 +1,98 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Файл называется по SHA-256 своего содержимого: posts/ab/abcdef….jpg.
+Одинаковые картинки хранятся один раз, а раз у них одно имя, sorl
+строит для них одни и те же миниатюры. На файл могут ссылаться
+несколько постов; удаляется он вместе с последним из них (см.
+posts.images.release).
+
+Проверка «файл уже есть» при сохранении и проверка «файл больше не
+нужен» при удалении выполняются под одной файловой блокировкой на
+хэш (lock), поэтому не перемежаются даже в разных процессах. Пост,
+который ещё не закоммичен, release не видит, поэтому новый пост
+закрепляет файл жёсткой ссылкой (pin) и после коммита возвращает его
+на место, если файл успели удалить (unpin).
+"""
+import fcntl
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+from contextlib import contextmanager
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_NAME = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}\.\w+$')
+
+
+def file_sha256(content):
+    """SHA-256 файла, прочитанного по частям."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def content_name(name, digest):
+    """Имя файла по хэшу содержимого в каталоге исходного имени."""
+    directory, filename = posixpath.split(name)
+    extension = posixpath.splitext(filename)[1].lower()
+    return posixpath.join(directory, digest[:2], digest + extension)
+
+
+def is_content_name(name):
+    return bool(CONTENT_NAME.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    @contextmanager
+    def lock(self, name):
+        """Блокировка файла name; файлы блокировок делятся по первым
+        двум символам хэша, поэтому их не больше 256."""
+        directory = os.path.join(self.location, '.locks')
+        os.makedirs(directory, exist_ok=True)
+        stripe = posixpath.basename(name)[:2]
+        with open(os.path.join(directory, stripe), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def pin(self, name):
+        """Жёсткая ссылка на файл name; возвращает её путь.
+
+        Если транзакция откатится, ссылка останется в .pinned: такие
+        файлы старше суток можно удалять.
+        """
+        directory = os.path.join(self.location, '.pinned')
+        os.makedirs(directory, exist_ok=True)
+        pinned = os.path.join(directory, uuid.uuid4().hex)
+        with self.lock(name):
+            os.link(self.path(name), pinned)
+        return pinned
+
+    def unpin(self, name, pinned):
+        """Убирает ссылку pin, вернув по ней файл name, если его удалили."""
+        with self.lock(name):
+            if not self.exists(name):
+                path = self.path(name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.link(pinned, path)
+            os.remove(pinned)
+
+    def _save(self, name, content):
+        name = content_name(name, file_sha256(content))
+        with self.lock(name):
+            # Такая картинка уже загружена: второй копии не будет.
+            if self.exists(name):
+                return name
+            return super()._save(name, content)
+
+
+post_images = ContentAddressedStorage()
@@ -0,0 +1,38 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import thumbnails
+from posts.cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts, show_author=True):
+    """Карточки постов страницы из общего кэша, разделённые линией."""
+    return mark_safe('<hr>'.join(render_cards(list(posts), show_author)))
+
+
+@register.inclusion_tag('posts/includes/responsive_image.html')
+def responsive_image(image, variants=None):
+    """Миниатюра поста с вариантами разной ширины в JPEG и WebP.
+
+    {% responsive_image post.image thumbnails %} — variants берутся
+    из prefetch; без них выбираются для одной картинки.
+    """
+    if not image:
+        return {}
+    if variants is None:
+        variants = thumbnails.prefetch([image.name])[image.name]
+    fallback = variants[thumbnails.CARD_VARIANTS.index(
+        (thumbnails.CARD_WIDTH, 'JPEG')
+    )]
+    # Пока пул не построил миниатюру, показывается оригинал.
+    return {
+        'src': fallback.url if fallback else image.url,
+        'original': fallback is None,
+        'jpeg_srcset': thumbnails.srcset(variants, 'JPEG'),
+        'webp_srcset': thumbnails.srcset(variants, 'WEBP'),
+        'width': thumbnails.CARD_WIDTH,
+        'height': thumbnails.CARD_HEIGHT,
+    }
@@ -0,0 +1,21 @@
+from django import template
+
+from posts.forms import CommentForm
+from posts.models import Follow
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def is_following(context, author_id):
+    """Подписан ли текущий пользователь на автора."""
+    user = context['request'].user
+    return user.is_authenticated and Follow.objects.filter(
+        user=user, author_id=author_id
+    ).exists()
+
+
+@register.simple_tag
+def comment_form():
+    """Пустая форма комментария для отложенного фрагмента."""
+    return CommentForm()
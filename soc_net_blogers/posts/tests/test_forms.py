@@ -1,13 +1,23 @@
+import hashlib
+import io
 import shutil
 import tempfile
+from unittest import mock
 
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
 from ..forms import PostForm
 from ..models import Comment, Group, Post, User
+from ..images import METADATA_FIELDS, release
+from ..storage import content_name, post_images
+from ..thumbnails import GEOMETRIES, plan
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -64,6 +74,260 @@ class PostCreateFormTests(TestCase):
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
 
+    @override_settings(POST_THUMBNAIL_WORKERS=0)
+    def test_thumbnails_generated_on_save(self):
+        """Миниатюры картинки строятся при сохранении поста."""
+        uploaded = SimpleUploadedFile(
+            name='thumbnail.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        with mock.patch('posts.thumbnails.get_thumbnail') as get_thumbnail:
+            self.authorized_client.post(
+                CREATE_PAGE,
+                data={'text': 'Пост с миниатюрой', 'image': uploaded},
+            )
+        post = Post.objects.get(text='Пост с миниатюрой')
+        # Картинка в 2 пикселя: варианты шире оригинала не строятся.
+        (source, *args), options = get_thumbnail.call_args
+        self.assertEqual(get_thumbnail.call_count, 1)
+        self.assertEqual(source.name, post.image.name)
+        self.assertEqual(
+            (args, options),
+            (['960x339'], {'crop': 'center', 'upscale': True,
+                           'format': 'JPEG'}),
+        )
+        self.assertEqual(len(plan(None)), len(GEOMETRIES))
+
+    def test_image_metadata_saved(self):
+        """При загрузке записываются размеры, формат, объём и хэш
+        картинки, а команда заполняет их для старых постов."""
+        uploaded = SimpleUploadedFile(
+            name='metadata.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        self.authorized_client.post(
+            CREATE_PAGE,
+            data={'text': 'Пост со сведениями', 'image': uploaded},
+        )
+        post = Post.objects.filter(text='Пост со сведениями')
+        expected = (2, 1, 'GIF', len(SMALL_GIF),
+                    hashlib.sha256(SMALL_GIF).hexdigest())
+        self.assertEqual(post.values_list(*METADATA_FIELDS).get(),
+                         expected)
+        post.update(image_width=None, image_height=None, image_format='',
+                    image_size=None, image_hash='')
+        call_command('fill_image_metadata', stdout=io.StringIO())
+        self.assertEqual(post.values_list(*METADATA_FIELDS).get(),
+                         expected)
+
+    def test_uploaded_image_processed(self):
+        """Большая картинка уменьшается и теряет EXIF,
+        картинка с лишними пикселями отклоняется."""
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Телефон'
+        Image.new('RGB', (3000, 1000), 'red').save(buffer, 'JPEG',
+                                                   exif=exif.tobytes())
+        uploaded = SimpleUploadedFile(
+            name='photo.jpeg',
+            content=buffer.getvalue(),
+            content_type='image/jpeg'
+        )
+        with override_settings(POST_IMAGE_MAX_SIDE=600):
+            self.authorized_client.post(
+                CREATE_PAGE,
+                data={'text': 'Пост с фото', 'image': uploaded},
+            )
+        post = Post.objects.get(text='Пост с фото')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        self.assertEqual((post.image_width, post.image_height), (600, 200))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.size, (600, 200))
+            self.assertFalse(image.getexif())
+        uploaded = SimpleUploadedFile(
+            name='big.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        with override_settings(POST_IMAGE_MAX_PIXELS=1):
+            response = self.authorized_client.post(
+                CREATE_PAGE,
+                data={'text': 'Пост с бомбой', 'image': uploaded},
+            )
+        self.assertTrue(response.context['form'].has_error('image'))
+        self.assertFalse(Post.objects.filter(text='Пост с бомбой').exists())
+
+    def test_large_png_rejected_before_decoding(self):
+        """PNG больше POST_IMAGE_MAX_DECODED_PIXELS отклоняется, JPEG
+        тех же размеров уменьшается при декодировании и принимается."""
+        for image_format, extension in (('PNG', 'png'), ('JPEG', 'jpeg')):
+            buffer = io.BytesIO()
+            Image.new('RGB', (4000, 3000), 'red').save(buffer, image_format)
+            uploaded = SimpleUploadedFile(
+                name=f'large.{extension}',
+                content=buffer.getvalue(),
+                content_type=f'image/{extension}'
+            )
+            with override_settings(POST_IMAGE_MAX_DECODED_PIXELS=10 ** 6), \
+                    mock.patch.object(Image.Image, 'load',
+                                      autospec=True,
+                                      side_effect=Image.Image.load) as load:
+                response = self.authorized_client.post(
+                    CREATE_PAGE,
+                    data={'text': f'Большой {image_format}',
+                          'image': uploaded},
+                )
+            with self.subTest(image_format=image_format):
+                if image_format == 'PNG':
+                    self.assertTrue(
+                        response.context['form'].has_error('image')
+                    )
+                    load.assert_not_called()
+                else:
+                    self.assertRedirects(response, PROFILE_PAGE)
+
+    def test_animated_image_kept(self):
+        """Анимированная картинка сохраняется со всеми кадрами."""
+        buffer = io.BytesIO()
+        frames = [Image.new('RGB', (10, 10), color)
+                  for color in ('red', 'green', 'blue')]
+        frames[0].save(buffer, 'WEBP', save_all=True,
+                       append_images=frames[1:])
+        self.authorized_client.post(CREATE_PAGE, data={
+            'text': 'Анимация',
+            'image': SimpleUploadedFile(
+                name='animation.webp',
+                content=buffer.getvalue(),
+                content_type='image/webp'
+            ),
+        })
+        post = Post.objects.get(text='Анимация')
+        with post.image.open() as stored:
+            self.assertEqual(stored.read(), buffer.getvalue())
+
+    def test_mpo_reencoded_as_jpeg(self):
+        """Из MPO сохраняется основной кадр в JPEG без EXIF."""
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Телефон'
+        frames = [Image.new('RGB', (10, 10), color)
+                  for color in ('red', 'green')]
+        frames[0].save(buffer, 'MPO', save_all=True,
+                       append_images=frames[1:], exif=exif.tobytes())
+        self.authorized_client.post(CREATE_PAGE, data={
+            'text': 'Снимок MPO',
+            'image': SimpleUploadedFile(
+                name='photo.jpg',
+                content=buffer.getvalue(),
+                content_type='image/jpeg'
+            ),
+        })
+        post = Post.objects.get(text='Снимок MPO')
+        self.assertEqual(post.image_format, 'JPEG')
+        with Image.open(post.image) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertFalse(image.getexif())
+
+    def test_metadata_formats_rejected(self):
+        """TIFF и анимация с EXIF не сохраняются как есть."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Телефон'
+        frames = [Image.new('RGB', (10, 10), color)
+                  for color in ('red', 'green')]
+        tiff = io.BytesIO()
+        frames[0].save(tiff, 'TIFF', exif=exif.tobytes())
+        webp = io.BytesIO()
+        frames[0].save(webp, 'WEBP', save_all=True,
+                       append_images=frames[1:], exif=exif.tobytes())
+        for name, buffer in (('photo.tiff', tiff), ('animation.webp', webp)):
+            with self.subTest(name=name):
+                response = self.authorized_client.post(CREATE_PAGE, data={
+                    'text': name,
+                    'image': SimpleUploadedFile(
+                        name=name, content=buffer.getvalue()
+                    ),
+                })
+                self.assertTrue(response.context['form'].has_error('image'))
+                self.assertFalse(Post.objects.filter(text=name).exists())
+
+    def test_identical_images_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом, который удаляется
+        вместе с последним ссылающимся постом."""
+        for number in range(2):
+            self.authorized_client.post(CREATE_PAGE, data={
+                'text': f'Дубликат #{number}',
+                'image': SimpleUploadedFile(
+                    name=f'copy_{number}.gif',
+                    content=SMALL_GIF,
+                    content_type='image/gif'
+                ),
+            })
+        first, second = Post.objects.filter(text__startswith='Дубликат')
+        self.assertEqual(first.image.name, second.image.name)
+        name = first.image.name
+        first.delete()
+        release(name)
+        self.assertTrue(post_images.exists(name))
+        second.delete()
+        release(name)
+        self.assertFalse(post_images.exists(name))
+
+    def test_release_racing_duplicate_upload(self):
+        """Файл, удалённый release до коммита поста-дубликата, после
+        коммита записывается заново."""
+        def upload(number):
+            self.authorized_client.post(CREATE_PAGE, data={
+                'text': f'Гонка #{number}',
+                'image': SimpleUploadedFile(
+                    name=f'race_{number}.gif',
+                    content=SMALL_GIF,
+                    content_type='image/gif'
+                ),
+            })
+            return Post.objects.get(text=f'Гонка #{number}')
+
+        first = upload(0)
+        name = first.image.name
+        callbacks = []
+        with mock.patch('posts.signals.transaction.on_commit',
+                        side_effect=callbacks.append):
+            second = upload(1)
+        self.assertEqual(second.image.name, name)
+        # Второй пост ещё не закоммичен: release его не видит.
+        Post.objects.filter(pk=second.pk).update(image='')
+        first.delete()
+        release(name)
+        self.assertFalse(post_images.exists(name))
+        Post.objects.filter(pk=second.pk).update(image=name)
+        for callback in callbacks:
+            callback()
+        with post_images.open(name) as stored:
+            self.assertEqual(stored.read(), SMALL_GIF)
+
+    def test_dedupe_images_command(self):
+        """Команда сливает старые копии картинки в один файл."""
+        names = [
+            FileSystemStorage().save(f'posts/old_{number}.gif',
+                                     ContentFile(SMALL_GIF))
+            for number in range(2)
+        ]
+        for name in names:
+            Post.objects.create(author=self.user, text='Старый пост',
+                                image=name)
+        call_command('dedupe_images', stdout=io.StringIO())
+        expected = content_name('posts/old.gif',
+                                hashlib.sha256(SMALL_GIF).hexdigest())
+        self.assertEqual(
+            set(Post.objects.filter(text='Старый пост').values_list(
+                'image', flat=True)),
+            {expected},
+        )
+        self.assertTrue(post_images.exists(expected))
+        for name in names:
+            self.assertFalse(post_images.exists(name))
+
     def test_create_post(self):
         """Валидная форма создает запись в Post."""
         # Подсчитаем количество записей в Post
@@ -89,9 +353,12 @@ class PostCreateFormTests(TestCase):
         # Проверяем, увеличилось ли число постов
         self.assertEqual(Post.objects.count(), posts_count + ONE_POST)
         # Проверяем, что создалась запись с заданным текстом и картинкой
+        # Картинка хранится под именем по хэшу содержимого
         self.assertTrue(Post.objects.filter(
             text='Тестовый пост с картинкой',
-            image='posts/small.gif').exists())
+            image=content_name('posts/small.gif',
+                               hashlib.sha256(SMALL_GIF).hexdigest())
+        ).exists())
 
     def test_edit_post(self):
         """Валидная форма изменяет запись в Post."""
@@ -1,8 +1,10 @@
 from datetime import datetime, timezone
+from io import StringIO
 
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Comment, Follow, Group, Post, User
+from ..models import Comment, Follow, Group, Post, User, UserStats
 
 
 class PostModelTest(TestCase):
@@ -76,3 +78,47 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     self.post._meta.get_field(field).help_text, expected_value)
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+
+    def assertStats(self, user, posts, followers, following):
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count,
+             stats.following_count),
+            (posts, followers, following)
+        )
+
+    def test_counters_follow_creates_and_deletes(self):
+        """Счётчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertStats(self.author, 1, 1, 0)
+        self.assertStats(self.reader, 0, 0, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        post.comments.all().delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertStats(self.reader, 0, 0, 0)
+        post.delete()
+        self.assertStats(self.author, 0, 0, 0)
+
+    def test_rebuild_counters(self):
+        """Команда rebuild_counters исправляет разошедшиеся счётчики."""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Пост #{i}') for i in range(3)
+        )
+        Follow.objects.bulk_create([
+            Follow(user=self.reader, author=self.author)
+        ])
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertStats(self.author, 3, 1, 0)
+        self.assertStats(self.reader, 0, 0, 1)
@@ -0,0 +1,298 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from posts import urls as posts_urls
+from users import urls as users_urls
+
+from ..admin import PostAdmin
+from ..management.commands.explain_queries import Command as ExplainCommand
+from ..models import Comment, Follow, Group, Post, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+AMOUNT_AUTHORS = 5
+POSTS_PER_AUTHOR = 15
+COMMENTS_PER_POST = 3
+# Допустимое число запросов: (аноним, авторизованный).
+# Кэш перед каждым запросом очищается, поэтому это худший случай:
+# в ленты входит и запрос миниатюр страницы в хранилище sorl-thumbnail.
+QUERY_BUDGETS = {
+    'posts:index': (2, 4),
+    'posts:group_list': (5, 7),
+    'posts:profile': (5, 8),
+    'posts:post_detail': (3, 5),
+    'posts:post_create': (0, 3),
+    'posts:post_edit': (0, 5),
+    'posts:add_comment': (0, 3),
+    'posts:follow_index': (0, 5),
+    'posts:search': (0, 2),
+    'posts:profile_follow': (0, 4),
+    'posts:profile_unfollow': (0, 12),
+    'users:signup': (0, 2),
+    'users:logout': (0, 4),
+    'users:login': (0, 2),
+    'users:password_change': (0, 2),
+    'users:password_change_done': (0, 2),
+    'users:password_reset': (0, 2),
+    'users:password_reset_done': (0, 2),
+    'users:password_reset_confirm': (1, 3),
+    'users:password_reset_complete': (0, 2),
+}
+# Посты и комментарии, которые добавляются одним bulk_create, чтобы
+# время запросов считалось не на пустых таблицах.
+SEED_POSTS = 3000
+SEED_COMMENTS_PER_POST = 2
+# Допустимое суммарное время SQL одной страницы, мс; на медленной
+# машине бюджеты умножаются на переменную окружения SQL_TIME_FACTOR.
+SQL_TIME_BUDGET = 20
+SQL_TIME_BUDGETS = {
+    'posts:search': 50,
+    'posts:profile_unfollow': 50,
+}
+SQL_TIME_FACTOR = float(os.environ.get('SQL_TIME_FACTOR', 1))
+# Список постов в админке при любом числе строк на странице.
+ADMIN_CHANGELIST_QUERIES = 7
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+class QueryTimer:
+    """Обёртка execute_wrapper: считает запросы и их время."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class QueryBudgetTests(TestCase):
+    """Число и время SQL-запросов для каждого адреса posts и users."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author_{i}', first_name='Имя', last_name='Фамилия'
+            )
+            for i in range(AMOUNT_AUTHORS)
+        ]
+        cls.user = cls.authors[0]
+        cls.groups = [
+            Group.objects.create(
+                title=f'Группа {i}', slug=f'group-{i}', description='Текст'
+            )
+            for i in range(2)
+        ]
+        for author in cls.authors[1:]:
+            Follow.objects.create(user=cls.user, author=author)
+        for i in range(POSTS_PER_AUTHOR):
+            for number, author in enumerate(cls.authors):
+                post = Post.objects.create(
+                    author=author,
+                    group=cls.groups[number % 2] if number else None,
+                    text=f'Пост #{i} автора {author.username}',
+                    image=SimpleUploadedFile(
+                        name=f'small_{i}.gif',
+                        content=SMALL_GIF,
+                        content_type='image/gif'
+                    ) if i % 5 == 0 else '',
+                )
+                Comment.objects.bulk_create(
+                    Comment(post=post, author=commentator, text='Коммент')
+                    for commentator in cls.authors[:COMMENTS_PER_POST]
+                )
+        cls.post = Post.objects.filter(author=cls.user).first()
+        cls.seed()
+        cls.url_kwargs = {
+            'slug': cls.groups[1].slug,
+            'username': cls.authors[1].username,
+            'post_id': cls.post.pk,
+            'uidb64': urlsafe_base64_encode(force_bytes(cls.user.pk)),
+            'token': default_token_generator.make_token(cls.user),
+        }
+        cls.results = []
+
+    @classmethod
+    def seed(cls):
+        """Добавляет SEED_POSTS постов с комментариями в обход сигналов,
+        затем пересчитывает счётчики, поисковый индекс и ленты."""
+        Post.objects.bulk_create(
+            Post(author=cls.authors[number % AMOUNT_AUTHORS],
+                 group=cls.groups[number % 2],
+                 text=f'Пост для объёма #{number}')
+            for number in range(SEED_POSTS)
+        )
+        seeded = Post.objects.filter(
+            text__startswith='Пост для объёма'
+        ).values_list('pk', flat=True)
+        Comment.objects.bulk_create(
+            Comment(post_id=post_id,
+                    author=cls.authors[number % AMOUNT_AUTHORS],
+                    text=f'Коммент для объёма #{number}')
+            for post_id in seeded
+            for number in range(SEED_COMMENTS_PER_POST)
+        )
+        for command in ('rebuild_counters', 'rebuild_search_index',
+                        'rebuild_timelines'):
+            call_command(command, stdout=io.StringIO())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        print(f'\n{"Адрес":<32}{"Клиент":<10}{"Запросов":>10}{"SQL, мс":>10}')
+        for name, client, queries, sql_time in cls.results:
+            print(f'{name:<32}{client:<10}{queries:>10}'
+                  f'{sql_time * 1000:>10.1f}')
+
+    def get_urls(self):
+        for module in (posts_urls, users_urls):
+            for pattern in module.urlpatterns:
+                if not pattern.name:
+                    continue
+                name = f'{module.app_name}:{pattern.name}'
+                kwargs = {
+                    key: self.url_kwargs[key]
+                    for key in pattern.pattern.converters
+                }
+                yield name, reverse(name, kwargs=kwargs)
+
+    def test_query_budgets(self):
+        """Страницы укладываются в бюджеты числа и времени запросов."""
+        for name, url in self.get_urls():
+            self.assertIn(name, QUERY_BUDGETS,
+                          f'Для адреса {name} не задан бюджет запросов')
+            for authorized, max_queries in zip(
+                (False, True), QUERY_BUDGETS[name]
+            ):
+                client = Client()
+                if authorized:
+                    client.force_login(self.user)
+                cache.clear()
+                timer = QueryTimer()
+                with connection.execute_wrapper(timer):
+                    client.get(url)
+                client_name = 'user' if authorized else 'guest'
+                self.results.append(
+                    (name, client_name, timer.queries, timer.seconds)
+                )
+                max_ms = SQL_TIME_BUDGETS.get(name, SQL_TIME_BUDGET)
+                with self.subTest(url=url, client=client_name):
+                    self.assertLessEqual(timer.queries, max_queries)
+                    self.assertLessEqual(timer.seconds * 1000,
+                                         max_ms * SQL_TIME_FACTOR)
+
+    def test_admin_changelist(self):
+        """Список постов в админке не делает запросов на каждую строку."""
+        admin_user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        client = Client()
+        client.force_login(admin_user)
+        url = reverse('admin:posts_post_changelist')
+        for params in ({}, {'p': 3}, {'q': 'автора'}):
+            cache.clear()
+            with mock.patch.object(PostAdmin, 'list_per_page', 10), \
+                    CaptureQueriesContext(connection) as context:
+                response = client.get(url, params)
+            with self.subTest(params=params):
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(context.captured_queries),
+                                     ADMIN_CHANGELIST_QUERIES)
+                result_list = response.context['cl'].result_list
+                self.assertEqual(len(result_list), 10)
+                # Список групп в каждой строке и в форме действий.
+                self.assertContains(response, self.groups[1].title,
+                                    count=len(result_list) + 1)
+        post = result_list[0]
+        response = client.post(url, {
+            'form-TOTAL_FORMS': 1,
+            'form-INITIAL_FORMS': 1,
+            'form-0-id': post.pk,
+            'form-0-group': self.groups[0].pk,
+            '_save': 'Сохранить',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Post.objects.get(pk=post.pk).group, self.groups[0])
+
+    def test_admin_autocomplete_filters(self):
+        """Фильтры по пользователям не выводят список всех пользователей."""
+        admin_user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        client = Client()
+        client.force_login(admin_user)
+        author = self.authors[1]
+        for name, lookup in (('comment', 'author__id__exact'),
+                             ('follow', 'author__id__exact'),
+                             ('follow', 'user__id__exact')):
+            url = reverse(f'admin:posts_{name}_changelist')
+            user = self.user if lookup.startswith('user') else author
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(url, {lookup: user.pk})
+            with self.subTest(url=url, lookup=lookup):
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(context.captured_queries),
+                                     ADMIN_CHANGELIST_QUERIES + 1)
+                self.assertContains(response, 'admin-autocomplete')
+                self.assertContains(
+                    response, f'<option value="{user.pk}" selected>'
+                )
+                self.assertNotContains(
+                    response, f'{lookup}={self.authors[2].pk}'
+                )
+                for obj in response.context['cl'].result_list:
+                    self.assertEqual(getattr(obj, lookup.split('__')[0]),
+                                     user)
+        response = client.get(reverse('admin:posts_comment_changelist'), {
+            'created__year': Comment.objects.first().created.year,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count,
+                         Comment.objects.count())
+
+    def test_explain_queries(self):
+        """Запросы страниц posts не читают таблицы целиком и не
+        сортируют во временных B-деревьях."""
+        stdout = io.StringIO()
+        call_command('explain_queries', stdout=stdout)
+        self.assertIn('используют индексы', stdout.getvalue())
+        tables = set(connection.introspection.table_names())
+        for sql in ('SELECT id FROM posts_post WHERE text = \'пост\'',
+                    'SELECT id FROM posts_post WHERE author_id = 1 '
+                    'ORDER BY text',
+                    'SELECT id FROM posts_post WHERE pub_date IS NOT NULL '
+                    'ORDER BY pub_date'):
+            with self.subTest(sql=sql):
+                self.assertTrue(ExplainCommand.check(sql, tables))
@@ -1,14 +1,29 @@
+import io
 import shutil
 import tempfile
+from datetime import timedelta
+from http import HTTPStatus
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
 
-from ..models import Comment, Follow, Group, Post, User
+from core import cache_tags
+
+from .. import bulk, checks, images, search, thumbnails
+from ..admin import PostAdmin
+from ..models import Comment, Follow, Group, Post, TimelineEntry, User
+from ..paginator import FeedPaginator
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -22,6 +37,7 @@ CREATE_PAGE = reverse('posts:post_create')
 FOLLOW_PROFILE = reverse('posts:profile_follow', args=(TEST_USERNAME, ))
 UNFOLLOW_PROFILE = reverse('posts:profile_unfollow', args=(TEST_USERNAME, ))
 FOLLOW_INDEX_PAGE = reverse('posts:follow_index')
+SEARCH_PAGE = reverse('posts:search')
 SMALL_GIF = (
     b'\x47\x49\x46\x38\x39\x61\x02\x00'
     b'\x01\x00\x80\x00\x00\x00\x00\x00'
@@ -32,6 +48,15 @@ SMALL_GIF = (
 )
 
 
+def run_on_commit_now(test):
+    """TestCase не коммитит транзакцию, поэтому колбэки on_commit
+    сигналов (сброс тегов кэша) выполняются сразу."""
+    patcher = mock.patch('posts.signals.transaction.on_commit',
+                         side_effect=lambda func: func())
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostPagesTests(TestCase):
     @classmethod
@@ -81,6 +106,7 @@ class PostPagesTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        run_on_commit_now(self)
         self.guest_client = Client()
 
         self.user = PostPagesTests.user
@@ -206,13 +232,251 @@ class PostPagesTests(TestCase):
     def test_cache_index_page(self):
         """Тестирование кэша на странице index"""
         response_1 = self.authorized_client.get(INDEX_PAGE).content
-        Post.objects.all().delete()
+        # update() не отправляет сигналов, теги кэша не сбрасываются.
+        Post.objects.update(text='Текст в обход сигналов')
         response_2 = self.authorized_client.get(INDEX_PAGE).content
         self.assertEqual(response_1, response_2)
         cache.clear()
         response_3 = self.authorized_client.get(INDEX_PAGE).content
         self.assertNotEqual(response_2, response_3)
 
+    def test_tags_invalidated_after_commit(self):
+        """Теги кэша сбрасываются только после коммита записи."""
+        tag = f'post:{self.post.pk}'
+        version = cache_tags.get_version(tag)
+        with mock.patch('posts.signals.transaction.on_commit') as on_commit:
+            Comment.objects.create(post=self.post, author=self.user,
+                                   text='Комментарий в транзакции')
+        self.assertEqual(cache_tags.get_version(tag), version)
+        for (callback, ), _ in on_commit.call_args_list:
+            callback()
+        self.assertNotEqual(cache_tags.get_version(tag), version)
+
+    def test_cache_invalidated_by_writes(self):
+        """Кэш лент сбрасывается при изменении и удалении постов."""
+        pages = (INDEX_PAGE, GROUP_LIST_PAGE, PROFILE_PAGE)
+        for page in pages:
+            self.authorized_client.get(page)
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Изменённый тестовый пост'
+        post.save()
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.authorized_client.get(page)
+                self.assertContains(response, 'Изменённый тестовый пост')
+        Post.objects.all().delete()
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.authorized_client.get(page)
+                self.assertNotContains(response, 'Изменённый тестовый пост')
+
+    def test_post_cards_shared_between_feeds(self):
+        """Карточка поста рендерится один раз для всех лент
+        и обновляется после редактирования."""
+        self.authorized_client.get(INDEX_PAGE)
+        # update() не меняет дату изменения: карточка остаётся в кэше.
+        Post.objects.update(text='Текст в обход сигналов')
+        response = self.authorized_client.get(GROUP_LIST_PAGE)
+        self.assertContains(response, self.post.text)
+        self.authorized_client.post(
+            self.POST_EDIT_PAGE,
+            {'text': 'Отредактированный пост', 'group': self.group.pk}
+        )
+        for page in (INDEX_PAGE, GROUP_LIST_PAGE, PROFILE_PAGE):
+            with self.subTest(page=page):
+                response = self.authorized_client.get(page)
+                self.assertContains(response, 'Отредактированный пост')
+
+    def test_post_cards_follow_author_and_group(self):
+        """Карточки обновляются после правки автора и группы."""
+        for page in (INDEX_PAGE, PROFILE_PAGE):
+            self.guest_client.get(page)
+        self.user.first_name, self.user.last_name = 'Новое', 'Имя'
+        self.user.save()
+        self.group.slug = 'new-slug'
+        self.group.save()
+        response = self.guest_client.get(INDEX_PAGE)
+        self.assertContains(response, 'Новое Имя')
+        for page in (INDEX_PAGE, PROFILE_PAGE):
+            with self.subTest(page=page):
+                self.assertContains(
+                    self.guest_client.get(page),
+                    reverse('posts:group_list', args=('new-slug',)),
+                )
+
+    def test_user_rename_refreshes_group_and_post_pages(self):
+        """Новое имя автора видно на странице группы (и ETag меняется),
+        новое имя комментатора — на странице поста."""
+        Comment.objects.create(post=self.post, author=self.not_author,
+                               text='Комментарий')
+        etag = self.guest_client.get(GROUP_LIST_PAGE)['ETag']
+        self.guest_client.get(self.POST_DETAIL_PAGE)
+        self.user.first_name, self.user.last_name = 'Новое', 'Имя'
+        self.user.save()
+        self.not_author.username = 'renamed_reader'
+        self.not_author.save()
+        response = self.guest_client.get(GROUP_LIST_PAGE,
+                                         HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Новое Имя')
+        self.assertContains(self.guest_client.get(self.POST_DETAIL_PAGE),
+                            'renamed_reader')
+
+    def test_group_delete_refreshes_pages(self):
+        """После удаления группы на страницах нет ссылок на неё."""
+        group = Group.objects.create(title='Удаляемая', slug='deleted')
+        post = Post.objects.create(author=self.user, group=group,
+                                   text='Пост удаляемой группы')
+        group_page = reverse('posts:group_list', args=(group.slug,))
+        pages = (INDEX_PAGE, PROFILE_PAGE,
+                 reverse('posts:post_detail', args=(post.pk,)))
+        for page in pages:
+            self.assertContains(self.guest_client.get(page), group_page)
+        Group.objects.get(pk=group.pk).delete()
+        for page in pages:
+            with self.subTest(page=page):
+                self.assertNotContains(self.guest_client.get(page),
+                                       group_page)
+
+    def store_thumbnail(self, image_name, geometry, options):
+        """Записывает миниатюру в хранилище ключей sorl."""
+        thumbnail = ImageFile(
+            thumbnails._thumbnail_name(image_name, geometry, options),
+            default.storage,
+        )
+        thumbnail.set_size(tuple(map(int, geometry.split('x'))))
+        default.kvstore.set(thumbnail)
+        return thumbnail
+
+    def test_sorl_thumbnail_check(self):
+        """Проверка при запуске сверяет версию sorl и его хранилище."""
+        self.assertEqual(checks.check_sorl_thumbnail(None), [])
+        with mock.patch('sorl.__version__', '99.0'), override_settings(
+            THUMBNAIL_KVSTORE='sorl.thumbnail.kvstores.redis_kvstore.KVStore'
+        ):
+            errors = checks.check_sorl_thumbnail(None)
+        self.assertEqual([error.id for error in errors],
+                         ['posts.E001', 'posts.E002'])
+
+    def test_card_thumbnails_prefetched(self):
+        """Миниатюры карточек выбираются из хранилища sorl одним
+        запросом и попадают в ленту и на страницу поста вместе
+        с вариантами для srcset."""
+        image_name = Post.objects.get(pk=self.post.pk).image.name
+        jpeg = self.store_thumbnail(image_name, *thumbnails.CARD_GEOMETRY)
+        webp = self.store_thumbnail(
+            image_name, '320x113', {**thumbnails.CARD_OPTIONS,
+                                    'format': 'WEBP'}
+        )
+        cache.clear()
+        with self.assertNumQueries(1):
+            prefetched = thumbnails.prefetch([image_name, 'posts/none.gif'])
+        self.assertEqual(
+            [variant.name for variant in prefetched[image_name] if variant],
+            [jpeg.name, webp.name],
+        )
+        self.assertEqual(prefetched['posts/none.gif'],
+                         [None] * len(thumbnails.GEOMETRIES))
+        for page in (INDEX_PAGE, self.POST_DETAIL_PAGE):
+            with self.subTest(page=page):
+                response = self.guest_client.get(page)
+                self.assertContains(response, f'src="{jpeg.url}"')
+                self.assertContains(response, f'srcset="{jpeg.url} 960w"')
+                self.assertContains(response, f'srcset="{webp.url} 320w"')
+
+    def test_card_without_thumbnails(self):
+        """Пока миниатюр нет, карточка показывает оригинал и кэшируется
+        ненадолго; построенные миниатюры сбрасывают карточку и ленту."""
+        post = Post.objects.get(pk=self.post.pk)
+        with mock.patch.object(cache, 'set_many',
+                               wraps=cache.set_many) as set_many:
+            response = self.guest_client.get(INDEX_PAGE)
+        self.assertContains(response, f'src="{post.image.url}"')
+        self.assertIn(settings.POST_CARD_PENDING_TIMEOUT,
+                      [timeout for (_, timeout), _ in set_many.call_args_list])
+        jpeg = self.store_thumbnail(post.image.name,
+                                    *thumbnails.CARD_GEOMETRY)
+        self.assertContains(self.guest_client.get(INDEX_PAGE),
+                            f'src="{post.image.url}"')
+        thumbnails.refresh(post.image.name)
+        self.assertContains(self.guest_client.get(INDEX_PAGE),
+                            f'src="{jpeg.url}"')
+
+    def test_whole_page_cache(self):
+        """Страница отдаётся из кэша до записи в базу."""
+        pages = (INDEX_PAGE, GROUP_LIST_PAGE, PROFILE_PAGE,
+                 self.POST_DETAIL_PAGE)
+        for page in pages:
+            with self.subTest(page=page):
+                first = self.guest_client.get(page)
+                self.assertTemplateUsed(first, 'base.html')
+                cached = self.guest_client.get(page)
+                self.assertTemplateNotUsed(cached, 'base.html')
+                self.assertEqual(cached.content, first.content)
+                Post.objects.get(pk=self.post.pk).save()
+                self.assertTemplateUsed(self.guest_client.get(page),
+                                        'base.html')
+        self.guest_client.get(self.POST_DETAIL_PAGE)
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Новый комментарий')
+        self.assertContains(self.guest_client.get(self.POST_DETAIL_PAGE),
+                            'Новый комментарий')
+
+    def test_cached_page_has_user_fragments(self):
+        """Страница из кэша содержит фрагменты текущего пользователя."""
+        self.guest_client.get(self.POST_DETAIL_PAGE)
+        response = self.authorized_client.get(self.POST_DETAIL_PAGE)
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertContains(response, f'Пользователь: {TEST_USERNAME}')
+        self.assertContains(response, 'редактировать запись')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        response = self.authorized_not_author.get(self.POST_DETAIL_PAGE)
+        self.assertContains(response, 'Пользователь: test_not_author')
+        self.assertNotContains(response, 'редактировать запись')
+        response = self.guest_client.get(self.POST_DETAIL_PAGE)
+        self.assertContains(response, 'Войти')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.authorized_not_author.get(PROFILE_PAGE)
+        Follow.objects.create(user=self.not_author, author=self.user)
+        self.assertContains(self.authorized_not_author.get(PROFILE_PAGE),
+                            'Отписаться')
+
+    def test_unchanged_pages_return_304(self):
+        """Неизменившаяся страница отдаёт 304, после записи — 200."""
+        pages = (INDEX_PAGE, GROUP_LIST_PAGE, PROFILE_PAGE,
+                 self.POST_DETAIL_PAGE)
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.guest_client.get(page)
+                # Last-Modified с точностью до секунды дал бы 304
+                # после записи в ту же секунду.
+                self.assertFalse(response.has_header('Last-Modified'))
+                etag = response['ETag']
+                response = self.guest_client.get(
+                    page, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                Comment.objects.create(post=self.post, author=self.user,
+                                       text='Новый комментарий')
+                Post.objects.get(pk=self.post.pk).save()
+                response = self.guest_client.get(
+                    page, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_profile_page_cache_shared_by_viewers(self):
+        """Кэш страницы автора общий для всех посетителей, а ETag
+        меняется после подписки посетителя."""
+        self.guest_client.get(PROFILE_PAGE)
+        with mock.patch('posts.views.render') as render:
+            response = self.authorized_not_author.get(PROFILE_PAGE)
+        render.assert_not_called()
+        etag = response['ETag']
+        Follow.objects.create(user=self.not_author, author=self.user)
+        response = self.authorized_not_author.get(
+            PROFILE_PAGE, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Отписаться')
+
     def test_follow_authorized(self):
         """Авторизованный пользователь может подписываться
         на других пользователей."""
@@ -248,6 +512,84 @@ class PostPagesTests(TestCase):
         response = self.authorized_not_author.get(FOLLOW_INDEX_PAGE)
         self.assertEqual(new_post, response.context['page_obj'][0])
 
+    def test_follow_adds_existing_posts_to_feed(self):
+        """После подписки в ленте появляются уже опубликованные посты
+        автора, а после отписки исчезают."""
+        self.authorized_not_author.get(FOLLOW_PROFILE)
+        response = self.authorized_not_author.get(FOLLOW_INDEX_PAGE)
+        self.assertIn(self.post, response.context['page_obj'])
+        self.authorized_not_author.get(UNFOLLOW_PROFILE)
+        response = self.authorized_not_author.get(FOLLOW_INDEX_PAGE)
+        self.assertNotIn(self.post, response.context['page_obj'])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_timeline_trimmed_on_follow(self):
+        """Лента подписок хранит не больше TIMELINE_LENGTH записей."""
+        for i in range(3):
+            Post.objects.create(author=self.user, text=f'Пост #{i}')
+        self.authorized_not_author.get(FOLLOW_PROFILE)
+        self.assertEqual(self.not_author.timeline.count(), 2)
+
+    @override_settings(TIMELINE_LENGTH=2, TIMELINE_TRIM_EVERY=2)
+    def test_timeline_trimmed_on_fan_out(self):
+        """Раскладка каждого TIMELINE_TRIM_EVERY-го поста обрезает
+        ленты подписчиков."""
+        Follow.objects.create(author=self.user, user=self.not_author)
+        for i in range(5):
+            Post.objects.create(author=self.user, text=f'Пост #{i}')
+        timeline = self.not_author.timeline.order_by('-pub_date', '-post')
+        self.assertLessEqual(timeline.count(), 3)
+        self.assertEqual(
+            list(timeline.values_list('post__text', flat=True)[:2]),
+            ['Пост #4', 'Пост #3'],
+        )
+
+    @override_settings(TIMELINE_CELEBRITY_FOLLOWERS=2)
+    def test_celebrity_posts_merged_into_feed(self):
+        """Посты популярного автора не раскладываются по лентам,
+        а подмешиваются в ленту подписок при чтении."""
+        reader = User.objects.create_user(username='test_reader')
+        Follow.objects.create(author=self.user, user=reader)
+        Follow.objects.create(author=self.user, user=self.not_author)
+        Follow.objects.create(author=self.not_author, user=reader)
+        cache.clear()
+        older_post = Post.objects.create(author=self.not_author,
+                                         text='Пост обычного автора')
+        celebrity_post = Post.objects.create(author=self.user,
+                                             text='Пост популярного автора')
+        self.assertFalse(celebrity_post.timeline_entries.exists())
+        self.assertTrue(older_post.timeline_entries.filter(
+            user=reader).exists())
+        reader_client = Client()
+        reader_client.force_login(reader)
+        response = reader_client.get(FOLLOW_INDEX_PAGE)
+        self.assertEqual(list(response.context['page_obj']),
+                         [celebrity_post, older_post, self.post])
+
+    @override_settings(TIMELINE_CELEBRITY_FOLLOWERS=2,
+                       BACKGROUND_WORKERS=0)
+    def test_celebrity_threshold_crossing(self):
+        """Ставший популярным автор убирается из лент подписчиков,
+        а переставший — раскладывается по ним вместе с постами,
+        написанными в популярности."""
+        reader = User.objects.create_user(username='test_reader')
+        Follow.objects.create(author=self.user, user=reader)
+        self.assertTrue(reader.timeline.filter(post=self.post).exists())
+        Follow.objects.create(author=self.user, user=self.not_author)
+        self.assertFalse(reader.timeline.exists())
+        celebrity_post = Post.objects.create(author=self.user,
+                                             text='Пост популярного автора')
+        self.assertFalse(celebrity_post.timeline_entries.exists())
+        Follow.objects.filter(user=self.not_author).delete()
+        self.assertEqual(
+            set(reader.timeline.values_list('post', flat=True)),
+            {self.post.pk, celebrity_post.pk},
+        )
+        new_post = Post.objects.create(author=self.user,
+                                       text='Пост обычного автора')
+        self.assertTrue(new_post.timeline_entries.filter(
+            user=reader).exists())
+
     def test_new_post_not_appear_for_non_subscribers(self):
         """Новая запись пользователя не появляется в ленте тех,
         кто не подписан на него."""
@@ -289,6 +631,7 @@ class PaginatorViewsTest(TestCase):
         cls.URLS = (INDEX_PAGE, GROUP_LIST_PAGE, PROFILE_PAGE)
 
     def setUp(self):
+        run_on_commit_now(self)
         # Создаем авторизованный клиент
         self.user = PaginatorViewsTest.user
         self.authorized_client = Client()
@@ -311,3 +654,318 @@ class PaginatorViewsTest(TestCase):
                 response = self.authorized_client.get(url + '?page=2')
                 self.assertEqual(len(response.context.get('page_obj')),
                                  self.SECOND_PAGE_POSTS_NUMBER)
+
+    def test_cursor_pages(self):
+        """Проверка: листание по курсору вперёд и назад."""
+        for url in self.URLS:
+            with self.subTest(url=url):
+                first_page = self.authorized_client.get(url).context.get(
+                    'page_obj')
+                response = self.authorized_client.get(
+                    url, {'cursor': first_page.next_cursor})
+                second_page = response.context.get('page_obj')
+                self.assertEqual(len(second_page),
+                                 self.SECOND_PAGE_POSTS_NUMBER)
+                self.assertEqual(second_page.number, 2)
+                self.assertFalse(second_page.has_next())
+                self.assertTrue(
+                    set(first_page).isdisjoint(set(second_page)))
+                response = self.authorized_client.get(
+                    url, {'cursor': second_page.previous_cursor})
+                self.assertEqual(list(response.context.get('page_obj')),
+                                 list(first_page))
+
+    def test_broken_cursor_shows_first_page(self):
+        """Проверка: испорченный курсор открывает первую страницу."""
+        response = self.authorized_client.get(INDEX_PAGE,
+                                              {'cursor': 'broken'})
+        self.assertEqual(response.context.get('page_obj').number, 1)
+        self.assertEqual(len(response.context.get('page_obj')),
+                         self.FIRST_PAGE_POSTS_NUMBER)
+
+    def test_page_links_are_windowed(self):
+        """Проверка: навигация показывает окно номеров, а не все страницы."""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Ещё пост #{i}')
+            for i in range(100)
+        )
+        response = self.authorized_client.get(INDEX_PAGE, {'page': 6})
+        self.assertEqual(response.context.get('page_obj').page_links,
+                         [1, '…', 4, 5, 6, 7, 8, '…', 12])
+
+    def test_feed_count_of_overlapping_streams(self):
+        """Пост из нескольких выборок ленты считается один раз."""
+        paginator = FeedPaginator(
+            [Post.objects.filter(author=self.user), Post.objects.all()],
+            settings.AMOUNT_PAGES,
+        )
+        self.assertEqual(paginator.count, Post.objects.count())
+        self.assertEqual(len(paginator.page(1)), settings.AMOUNT_PAGES)
+
+    def test_feed_count_is_cached(self):
+        """Проверка: число записей ленты берётся из кэша."""
+        self.authorized_client.get(INDEX_PAGE)
+        Post.objects.create(author=self.user, text='Новый пост')
+        response = self.authorized_client.get(INDEX_PAGE)
+        self.assertEqual(response.context.get('page_obj').paginator.count,
+                         self.AMOUNT_POSTS)
+
+    @override_settings(FEED_COUNT_LIMIT=5)
+    def test_feed_count_estimated_for_large_feeds(self):
+        """Проверка: для большой ленты число записей оценивается."""
+        for url in self.URLS:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                paginator = response.context.get('page_obj').paginator
+                self.assertFalse(paginator.count_is_exact)
+                self.assertGreaterEqual(paginator.count, 5)
+                self.assertNotContains(response, 'Последняя')
+
+
+@override_settings(AMOUNT_PAGES=2)
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username=TEST_USERNAME)
+        cls.in_text = Post.objects.create(
+            author=cls.user, text='Рецепт пирога с яблоками')
+        cls.in_comment = Post.objects.create(
+            author=cls.user, text='Фотографии с дачи')
+        Comment.objects.create(post=cls.in_comment, author=cls.user,
+                               text='Какие красивые яблоки')
+        for number in range(2):
+            Post.objects.create(author=cls.user,
+                                text=f'Яблоки и груши #{number}')
+        cls.other = Post.objects.create(author=cls.user,
+                                        text='Про погоду')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_search_ranked_with_cursor(self):
+        """Поиск находит посты по тексту и комментариям, совпадения
+        в тексте поста выше, страницы листаются курсором."""
+        response = self.client.get(SEARCH_PAGE, {'q': 'ЯБЛОК'})
+        found = list(response.context['posts'])
+        next_cursor = response.context['next_cursor']
+        response = self.client.get(SEARCH_PAGE,
+                                   {'q': 'ЯБЛОК', 'cursor': next_cursor})
+        found += response.context['posts']
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertEqual(len(found), 4)
+        self.assertEqual(found[-1], self.in_comment)
+        self.assertNotIn(self.other, found)
+
+    def test_index_follows_writes(self):
+        """Индекс обновляется при изменении и удалении записей."""
+        post = Post.objects.get(pk=self.in_text.pk)
+        post.text = 'Рецепт пирога с вишней'
+        post.save()
+        self.assertEqual(search.search_posts('вишн', 10)[0],
+                         [(post.pk, mock.ANY)])
+        Comment.objects.filter(post=self.in_comment).delete()
+        post.delete()
+        found = [pk for pk, _ in search.search_posts('яблок', 10)[0]]
+        self.assertEqual(len(found), 2)
+        self.assertNotIn(self.in_comment.pk, found)
+
+    def test_unsafe_query(self):
+        """Синтаксис FTS5 в запросе не ломает поиск."""
+        for query in ('"', 'AND', 'NEAR(', '*', '-яблоки'):
+            with self.subTest(query=query):
+                response = self.client.get(SEARCH_PAGE, {'q': query})
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_rebuild_and_admin_search(self):
+        """Команда пересобирает индекс, админка ищет по нему."""
+        Post.objects.filter(pk=self.other.pk).update(text='Погода и яблоки')
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(
+            set(search.filter_queryset(Post.objects.all(), 'яблок')),
+            {self.in_text, self.other,
+             *Post.objects.filter(text__startswith='Яблоки')},
+        )
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'), {'q': 'красивые'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, BULK_CHUNK_SIZE=2,
+                   BACKGROUND_WORKERS=0)
+class AdminBulkActionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username=TEST_USERNAME)
+        cls.follower = User.objects.create_user(username='follower')
+        Follow.objects.create(user=cls.follower, author=cls.user)
+        cls.groups = [
+            Group.objects.create(title=f'Группа {number}',
+                                 slug=f'group-{number}')
+            for number in range(2)
+        ]
+        for number in range(5):
+            post = Post.objects.create(
+                author=cls.user, group=cls.groups[0],
+                text=f'Пост про яблоки #{number}',
+                image=SimpleUploadedFile(
+                    name='small.gif', content=SMALL_GIF,
+                    content_type='image/gif'
+                ) if number < 2 else '',
+            )
+            Comment.objects.create(post=post, author=cls.follower,
+                                   text='Комментарий про яблоки')
+        cls.kept = Post.objects.order_by('pk').first()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def run_action(self, model, action, selected, **data):
+        return self.client.post(
+            reverse(f'admin:posts_{model}_changelist'), {
+                'action': action,
+                '_selected_action': [obj.pk for obj in selected],
+                **data,
+            }
+        )
+
+    def test_delete_posts_in_chunks(self):
+        """Посты удаляются пачками вместе с зависимыми записями,
+        а общий файл картинки остаётся, пока нужен другому посту."""
+        selected = Post.objects.exclude(pk=self.kept.pk)
+        response = self.run_action('post', 'delete_in_chunks', selected)
+        self.assertContains(response, 'Будут удалены публикации: 4.')
+        self.assertEqual(Post.objects.count(), 5)
+        image = self.kept.image.name
+        with mock.patch('core.background.transaction.on_commit',
+                        side_effect=lambda func: func()), \
+                mock.patch('posts.images.release',
+                           wraps=images.release) as release:
+            response = self.run_action('post', 'delete_in_chunks',
+                                       list(selected), post='yes')
+        self.assertRedirects(response,
+                             reverse('admin:posts_post_changelist'))
+        self.assertEqual(list(Post.objects.all()), [self.kept])
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(
+            list(self.follower.timeline.values_list('post', flat=True)),
+            [self.kept.pk],
+        )
+        self.assertEqual(User.objects.get(pk=self.user.pk).stats.posts_count,
+                         1)
+        self.assertEqual(
+            [pk for pk, _ in search.search_posts('яблок', 10)[0]],
+            [self.kept.pk],
+        )
+        release.assert_called_once_with(image)
+        self.assertTrue(images.post_images.exists(image))
+
+    def test_bulk_delete_knows_all_relations(self):
+        """Пакетное удаление идёт в обход Collector и чистит связанные
+        таблицы само: других связей у постов и комментариев нет."""
+        self.assertEqual(
+            {(relation.related_model, relation.field.name)
+             for relation in Post._meta.related_objects},
+            {(Comment, 'post'), (TimelineEntry, 'post')},
+        )
+        self.assertEqual(Comment._meta.related_objects, ())
+
+    def test_delete_comments_in_chunks(self):
+        """Удаление комментариев уменьшает их счётчики у постов."""
+        response = self.run_action('comment', 'delete_in_chunks',
+                                   Comment.objects.all(), post='yes')
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(
+            set(Post.objects.values_list('comments_count', flat=True)), {0}
+        )
+        self.assertEqual(search.search_posts('комментар', 10)[0], [])
+
+    def test_interrupted_action_reports_progress(self):
+        """Если пачка упала, уже закоммиченные пачки остаются удалёнными,
+        а админ видит, сколько записей обработано."""
+        delete_chunk = bulk._delete_comments
+
+        def fail_second_chunk(ids):
+            if fail_second_chunk.calls:
+                raise DatabaseError('database is locked')
+            fail_second_chunk.calls += 1
+            return delete_chunk(ids)
+
+        fail_second_chunk.calls = 0
+        with mock.patch('posts.bulk._delete_comments', fail_second_chunk), \
+                self.assertLogs('posts.admin', 'ERROR'):
+            self.run_action('comment', 'delete_in_chunks',
+                            Comment.objects.all(), post='yes')
+        self.assertEqual(Comment.objects.count(), 3)
+        response = self.client.get(reverse('admin:posts_comment_changelist'))
+        self.assertContains(response, 'Обработано записей: 2 из 5')
+
+    def test_comment_date_hierarchy(self):
+        """Навигация по датам комментариев строится по MIN и MAX даты,
+        без DISTINCT по всем строкам."""
+        url = reverse('admin:posts_comment_changelist')
+        now = timezone.now()
+        Comment.objects.filter(pk=Comment.objects.first().pk).update(
+            created=now - timedelta(days=800)
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertFalse([query for query in context.captured_queries
+                          if 'DISTINCT' in query['sql']])
+        for year in range(now.year - 2, now.year + 1):
+            self.assertContains(response, f'?created__year={year}"')
+        response = self.client.get(url, {'created__year': now.year,
+                                         'created__month': now.month})
+        self.assertContains(
+            response, f'created__day={now.day}&amp;created__month='
+        )
+
+    @override_settings(FEED_COUNT_LIMIT=3)
+    def test_changelist_pages_past_estimated_count(self):
+        """Отфильтрованный список, число записей которого только
+        оценено, листается до конца и заканчивается пустой страницей."""
+        url = reverse('admin:posts_post_changelist')
+        filters = {'group__id__exact': self.groups[0].pk}
+        with mock.patch.object(PostAdmin, 'list_per_page', 2):
+            pages = [
+                self.client.get(url, {**filters, 'p': number})
+                for number in range(4)
+            ]
+        for number, expected in enumerate((2, 2, 1, 0)):
+            with self.subTest(page=number):
+                self.assertEqual(pages[number].status_code, HTTPStatus.OK)
+                cl = pages[number].context['cl']
+                self.assertFalse(cl.paginator.count_is_exact)
+                self.assertEqual(len(cl.result_list), expected)
+
+    def test_remove_from_group(self):
+        """Действие убирает посты из групп."""
+        self.run_action('post', 'remove_from_group', Post.objects.all())
+        self.assertFalse(Post.objects.filter(group__isnull=False).exists())
+
+    def test_move_to_group(self):
+        """Посты переносятся в выбранную группу, страницы групп
+        сбрасываются."""
+        response = self.client.get(
+            reverse('posts:group_list', args=(self.groups[1].slug,)))
+        self.assertEqual(len(response.context['page_obj']), 0)
+        self.run_action('post', 'move_to_group', Post.objects.all(),
+                        group=self.groups[1].pk)
+        self.assertEqual(self.groups[1].group.count(), 5)
+        response = self.client.get(
+            reverse('posts:group_list', args=(self.groups[1].slug,)))
+        self.assertEqual(len(response.context['page_obj']), 5)
+        response = self.run_action('post', 'move_to_group',
+                                   Post.objects.all())
+        self.assertEqual(self.groups[1].group.count(), 5)
@@ -0,0 +1,227 @@
+"""Заранее подготовленные миниатюры картинок постов.
+
+Шаблоны лент и страницы поста показывают миниатюры, и первый
+просмотр нового поста декодировал и уменьшал оригинал прямо в запросе.
+Теперь миниатюры всех размеров из GEOMETRIES строятся в фоновом пуле
+потоков сразу после сохранения поста, а тег находит их в хранилище
+ключей sorl. Для старых постов есть команда generate_thumbnails.
+
+Для каждой картинки строится несколько ширин (CARD_WIDTHS) в JPEG и
+WebP, а тег responsive_image отдаёт их через srcset и sizes, чтобы
+телефон скачивал самый маленький подходящий файл. Пока миниатюр нет,
+тег показывает оригинал, а карточка кэшируется ненадолго; когда пул
+их построит, карточки и страницы поста сбрасываются.
+
+Карточки страницы ленты получают свои миниатюры из prefetch: одним
+get_many из кэша и одним запросом к таблице хранилища (cached_db,
+хранилище sorl по умолчанию) вместо обращения на каждую картинку.
+Для этого prefetch повторяет внутренние расчёты sorl и читает его
+хранилище напрямую, поэтому версия sorl закреплена в requirements.txt,
+а проверка posts.checks при запуске сверяет её и THUMBNAIL_KVSTORE
+с SORL_VERSION и SORL_KVSTORE.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from core import cache_tags
+
+from .models import Post
+from .signals import post_tags
+from .storage import post_images
+
+logger = logging.getLogger(__name__)
+
+# Версия sorl-thumbnail и хранилище ключей, с которыми сверены
+# _thumbnail_name и prefetch.
+SORL_VERSION = '12.7.0'
+SORL_KVSTORE = 'sorl.thumbnail.kvstores.cached_db_kvstore.KVStore'
+
+# Миниатюра в карточке поста и на странице поста.
+CARD_WIDTH, CARD_HEIGHT = 960, 339
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+CARD_GEOMETRY = (f'{CARD_WIDTH}x{CARD_HEIGHT}', CARD_OPTIONS)
+# Варианты для srcset: (ширина, формат); пропорции как у CARD_GEOMETRY.
+CARD_WIDTHS = (320, 640, CARD_WIDTH)
+CARD_FORMATS = ('JPEG', 'WEBP')
+CARD_VARIANTS = tuple(
+    (width, image_format) for image_format in CARD_FORMATS
+    for width in CARD_WIDTHS
+)
+# Все размеры, которые строятся заранее.
+GEOMETRIES = tuple(
+    (f'{width}x{round(width * CARD_HEIGHT / CARD_WIDTH)}',
+     {**CARD_OPTIONS, 'format': image_format})
+    for width, image_format in CARD_VARIANTS
+)
+
+_executor = None
+
+
+def plan(width=None):
+    """Размеры миниатюр для картинки шириной width пикселей.
+
+    Варианты шире оригинала дают только лишний объём и пропускаются;
+    основная миниатюра карточки строится всегда. Ширина берётся из
+    поста, поэтому сам файл для этого не открывается.
+    """
+    return [
+        geometry
+        for variant, geometry in zip(CARD_VARIANTS, GEOMETRIES)
+        if width is None or variant[0] <= width
+        or variant == (CARD_WIDTH, 'JPEG')
+    ]
+
+
+def generate(image_name, width=None):
+    """Строит миниатюры картинки image_name по плану plan(width)."""
+    try:
+        source = ImageFile(image_name, post_images)
+        for geometry, options in plan(width):
+            get_thumbnail(source, geometry, **options)
+    except Exception:
+        # Без миниатюр карточка показывает оригинал.
+        logger.exception('Не удалось построить миниатюры %s', image_name)
+    finally:
+        close_old_connections()
+
+
+def is_complete(variants, width=None):
+    """Готовы ли все миниатюры plan(width); variants — из prefetch."""
+    planned = plan(width)
+    return all(
+        thumbnail
+        for thumbnail, geometry in zip(variants, GEOMETRIES)
+        if geometry in planned
+    )
+
+
+def refresh(image_name):
+    """Сбрасывает карточки и страницы постов с картинкой image_name:
+    до появления миниатюр на них показывался оригинал."""
+    # posts.cards сам импортирует этот модуль.
+    from . import cards
+    posts = list(Post.objects.filter(image=image_name).only(
+        'author_id', 'group_id', 'updated'
+    ))
+    for post in posts:
+        cards.invalidate(post)
+    cache_tags.invalidate(*{
+        tag for post in posts
+        for tag in post_tags(post.pk, post.author_id, post.group_id)
+    })
+
+
+def _build(image_name, width):
+    """Задача пула: миниатюры нового поста, затем сброс его страниц."""
+    generate(image_name, width)
+    try:
+        refresh(image_name)
+    except Exception:
+        logger.exception('Не удалось сбросить страницы с %s', image_name)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.POST_THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def schedule(post):
+    """Ставит построение миниатюр поста в очередь после коммита.
+
+    При POST_THUMBNAIL_WORKERS = 0 миниатюры строятся сразу.
+    """
+    if not post.image:
+        return
+    image_name, width = post.image.name, post.image_width
+    if not settings.POST_THUMBNAIL_WORKERS:
+        generate(image_name, width)
+        return
+    transaction.on_commit(
+        lambda: _get_executor().submit(_build, image_name, width)
+    )
+
+
+def _thumbnail_name(image_name, geometry, options):
+    """Имя файла миниатюры, как его вычисляет get_thumbnail в sorl."""
+    backend = default.backend
+    source = ImageFile(image_name, post_images)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return backend._get_thumbnail_filename(source, geometry, options)
+
+
+def prefetch(image_names, geometries=GEOMETRIES):
+    """Готовые миниатюры картинок: {имя картинки: [ImageFile или None]}.
+
+    Список идёт в порядке geometries; None — миниатюры этого размера
+    ещё нет в хранилище ключей.
+    """
+    image_names = set(image_names)
+    keys = {
+        add_prefix(ImageFile(
+            _thumbnail_name(name, geometry, options), default.storage
+        ).key): (name, index)
+        for name in image_names
+        for index, (geometry, options) in enumerate(geometries)
+    }
+    if not keys:
+        return {}
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(list(keys))
+    missing = [key for key in keys if key not in values]
+    if missing:
+        stored = dict(
+            KVStore.objects.filter(key__in=missing).values_list(
+                'key', 'value'
+            )
+        )
+        # Как и sorl, запоминаем отсутствие записи, чтобы тег, который
+        # построит недостающую миниатюру, не искал её в базе снова.
+        kv_cache.set_many(
+            {key: stored.get(key, EMPTY_VALUE) for key in missing},
+            sorl_settings.THUMBNAIL_CACHE_TIMEOUT,
+        )
+        values.update(stored)
+    found = {name: [None] * len(geometries) for name in image_names}
+    for key, value in values.items():
+        if value != EMPTY_VALUE:
+            name, index = keys[key]
+            found[name][index] = deserialize_image_file(value)
+    return found
+
+
+def srcset(variants, image_format):
+    """Значение srcset из готовых вариантов формата image_format.
+
+    variants — список из prefetch для GEOMETRIES.
+    """
+    return ', '.join(
+        f'{thumbnail.url} {width}w'
+        for (width, variant_format), thumbnail in zip(CARD_VARIANTS,
+                                                      variants)
+        if thumbnail and variant_format == image_format
+    )
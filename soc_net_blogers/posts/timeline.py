@@ -0,0 +1,173 @@
+"""Лента подписок: гибрид fan-out on write и чтения при запросе.
+
+Посты обычных авторов раскладываются по лентам подписчиков при записи.
+Посты популярных авторов (не меньше TIMELINE_CELEBRITY_FOLLOWERS
+подписчиков) не раскладываются: они выбираются при чтении ленты и
+сливаются с разложенными по дате публикации.
+
+Правила поддержки:
+* новый пост обычного автора раскладывается по лентам подписчиков пачками;
+  каждый TIMELINE_TRIM_EVERY-й пост (по id) обрезает ленты подписчиков
+  своего автора, поэтому ленты не растут без предела, а обрезка стоит
+  в среднем 1/TIMELINE_TRIM_EVERY прохода по подписчикам на пост;
+* при подписке в ленту добавляются последние посты автора, после чего
+  лента обрезается до TIMELINE_LENGTH записей;
+* при отписке из ленты удаляются все посты автора;
+* автор, ставший популярным, убирается из лент подписчиков (его посты
+  теперь подмешиваются при чтении), а переставший быть популярным
+  раскладывается по их лентам заново в фоне после коммита: иначе посты,
+  написанные им в популярности, пропали бы из лент.
+
+Переход отслеживается по изменению числа подписчиков на единицу. После
+изменения самого TIMELINE_CELEBRITY_FOLLOWERS авторы в новый режим не
+переводятся: ленты нужно пересобрать командой rebuild_timelines.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+
+from core import background
+
+from .models import Follow, Post, TimelineEntry, UserStats
+
+CELEBRITIES_KEY = 'timeline:celebrities'
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def celebrity_ids():
+    """Множество id популярных авторов, кэшируется на короткое время."""
+    def get_ids():
+        return set(UserStats.objects.filter(
+            followers_count__gte=settings.TIMELINE_CELEBRITY_FOLLOWERS
+        ).values_list('user_id', flat=True))
+    return cache.get_or_set(
+        CELEBRITIES_KEY, get_ids,
+        settings.TIMELINE_CELEBRITIES_CACHE_TIMEOUT
+    )
+
+
+def feed_streams(user):
+    """Выборки постов, из которых сливается лента подписок."""
+    # Ключ ленты берётся из записей ленты: так сортировка читает
+    # индекс timeline_user_pub_date, а не сортирует все записи.
+    streams = [Post.objects.filter(timeline_entries__user=user).annotate(
+        feed_date=F('timeline_entries__pub_date'),
+        feed_pk=F('timeline_entries__post_id'),
+    )]
+    celebrities = Follow.objects.filter(
+        user=user, author_id__in=celebrity_ids()
+    ).values_list('author_id', flat=True)
+    if celebrities:
+        streams.append(Post.objects.filter(author_id__in=list(celebrities)))
+    return streams
+
+
+def fan_out(post):
+    """Добавляет пост в ленты всех подписчиков обычного автора."""
+    if post.author_id in celebrity_ids():
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True
+    ).iterator()
+    for user_ids in _batches(followers, settings.TIMELINE_BATCH_SIZE):
+        with transaction.atomic():
+            TimelineEntry.objects.bulk_create(
+                [
+                    TimelineEntry(
+                        user_id=user_id, post=post, pub_date=post.pub_date
+                    )
+                    for user_id in user_ids
+                ],
+                ignore_conflicts=True,
+            )
+            if post.pk % settings.TIMELINE_TRIM_EVERY == 0:
+                for user_id in user_ids:
+                    trim(user_id)
+
+
+@transaction.atomic
+def backfill(user, author):
+    """Добавляет в ленту пользователя последние посты обычного автора."""
+    if author.pk in celebrity_ids():
+        return
+    posts = Post.objects.filter(author=author).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:settings.TIMELINE_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=user, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in posts
+        ],
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim(user)
+
+
+def followers_changed(author_id, delta):
+    """Меняет режим автора, если число его подписчиков, изменившись
+    на delta, пересекло TIMELINE_CELEBRITY_FOLLOWERS."""
+    threshold = settings.TIMELINE_CELEBRITY_FOLLOWERS
+    followers = UserStats.objects.filter(user_id=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if delta > 0 and followers == threshold:
+        became_celebrity = True
+    elif delta < 0 and followers == threshold - 1:
+        became_celebrity = False
+    else:
+        return
+    # Сначала сбрасывается список популярных: по нему решает backfill.
+    transaction.on_commit(lambda: cache.delete(CELEBRITIES_KEY))
+    if became_celebrity:
+        TimelineEntry.objects.filter(post__author_id=author_id).delete()
+    else:
+        background.run_after_commit(backfill_followers, author_id)
+
+
+def backfill_followers(author_id):
+    """Добавляет последние посты автора в ленты всех его подписчиков."""
+    follows = Follow.objects.filter(author_id=author_id).select_related(
+        'user', 'author'
+    )
+    for follow in follows.iterator():
+        backfill(follow.user, follow.author)
+
+
+def remove(user, author):
+    """Убирает из ленты пользователя все посты автора."""
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def trim(user):
+    """Оставляет в ленте только TIMELINE_LENGTH самых свежих записей.
+
+    user — пользователь или его id.
+    """
+    entries = TimelineEntry.objects.filter(user=user)
+    first_dropped = entries.order_by('-pub_date', '-post_id').values_list(
+        'pub_date', 'post_id'
+    )[settings.TIMELINE_LENGTH:settings.TIMELINE_LENGTH + 1]
+    if first_dropped:
+        pub_date, post_id = first_dropped[0]
+        entries.filter(
+            Q(pub_date__lt=pub_date)
+            | Q(pub_date=pub_date, post_id__lte=post_id)
+        ).delete()
+
+
+def rebuild(user):
+    """Собирает ленту пользователя заново по его подпискам."""
+    TimelineEntry.objects.filter(user=user).delete()
+    for follow in Follow.objects.filter(user=user).select_related('author'):
+        backfill(user, follow.author)
@@ -2,30 +2,51 @@ from datetime import datetime
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404, redirect, render
 
+from . import cards, search, thumbnails, timeline
+from .conditional import (conditional_page, group_tags, index_tags,
+                          post_tags, profile_tags, viewer_tags)
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, User
+from .page_cache import cache_whole_page
+from .paginator import paginate
 
 
+@conditional_page(index_tags)
+@cache_whole_page(index_tags)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, settings.AMOUNT_PAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    """Главная лента.
+
+    Бюджет: 2 запроса — подсчёт записей (обычно из кэша) и страница
+    постов; авторизованный пользователь добавляет 2 запроса сессии.
+    Ответ 304 и страница из кэша обходятся без этих двух запросов.
+    Миниатюры новых карточек выбираются одним общим запросом.
+    """
+    post_list = Post.objects.for_feed()
+    page_obj = paginate(request, post_list)
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page(group_tags)
+@cache_whole_page(group_tags)
 def group_posts(request, slug):
+    """Лента группы.
+
+    Бюджет: 4 запроса — id группы для ETag, группа, подсчёт записей
+    (обычно из кэша) и страница постов; плюс 2 запроса сессии для
+    авторизованного. Если страница не менялась — только первый.
+    Страница из кэша стоит того же одного запроса.
+    Миниатюры новых карточек выбираются одним общим запросом.
+    """
     group = get_object_or_404(Group, slug=slug)
-    posts_group = group.group.all()
-    paginator = Paginator(posts_group, settings.AMOUNT_PAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts_group = Post.objects.for_feed().filter(group=group)
+    page_obj = paginate(request, posts_group)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -33,37 +54,83 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(profile_tags, viewer_tags)
+@cache_whole_page(profile_tags)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts_author = Post.objects.filter(author=author)
-    paginator = Paginator(posts_author, settings.AMOUNT_PAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    following = False
-    if request.user.is_authenticated and request.user != author:
-        following = Follow.objects.filter(
-            user=request.user, author=author).exists()
+    """Лента автора.
+
+    Бюджет: 4 запроса — id автора для ETag, автор со счётчиками,
+    подсчёт записей (обычно из кэша) и страница постов; авторизованный
+    добавляет 2 запроса сессии и проверку подписки в кнопке. Если
+    страница не менялась — только первый.
+    Страница из кэша стоит того же одного запроса.
+    Миниатюры новых карточек выбираются одним общим запросом.
+    """
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    posts_author = Post.objects.for_feed().filter(author=author)
+    page_obj = paginate(request, posts_author)
     context = {
         'author': author,
         'posts': posts_author,
         'page_obj': page_obj,
-        'following': following
     }
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(post_tags)
+@cache_whole_page(post_tags)
 def post_detail(request, post_id):
-    post = Post.objects.get(pk=post_id)
-    form = CommentForm()
+    """Страница поста.
+
+    Бюджет: 3 запроса — автор поста для ETag, пост с автором, его
+    счётчиками и группой, и комментарии с авторами; плюс 2 запроса
+    сессии. Если страница не менялась — только первый.
+    Страница из кэша стоит того же одного запроса.
+    """
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related(
+            'author__stats'
+        ).prefetch_related(
+            Prefetch(
+                'comments',
+                queryset=Comment.objects.select_related('author').only(
+                    'text', 'created', 'post', 'author__username'
+                )
+            )
+        ),
+        pk=post_id
+    )
     # comments = post.comments.all()
     context = {
         'post': post,
-        'form': form,
         # 'comments': comments,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_search(request):
+    """Поиск по текстам постов и комментариев.
+
+    Бюджет: запрос к поисковому индексу и запрос постов страницы;
+    авторизованный пользователь добавляет 2 запроса сессии.
+    """
+    query = request.GET.get('q', '').strip()
+    cursor = request.GET.get('cursor', '')
+    found, next_cursor = search.search_posts(
+        query, settings.AMOUNT_PAGES, cursor
+    )
+    posts = Post.objects.for_feed().in_bulk([pk for pk, _ in found])
+    context = {
+        'query': query,
+        'posts': [posts[pk] for pk, _ in found if pk in posts],
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(request.POST or None, files=request.FILES or None,)
@@ -71,7 +138,10 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.pub_date = datetime.now()
-        post.save()
+        # Счётчики и ленты подписчиков обновляются в той же транзакции.
+        with transaction.atomic():
+            post.save()
+            thumbnails.schedule(post)
         username = post.author.username
         return redirect('posts:profile', username)
     return render(request, 'posts/create_post.html', {'form': form})
@@ -88,7 +158,10 @@ def post_edit(request, post_id):
         instance=post
     )
     if request.method == "POST" and form.is_valid():
+        cards.invalidate(post)
         form.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post)
         return redirect('posts:post_detail', post.pk)
     context = {
         'post': post,
@@ -106,17 +179,24 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.select_related('author').filter(
-        author__following__user=request.user)
-    paginator = Paginator(post_list, settings.AMOUNT_PAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    """Лента подписок.
+
+    Бюджет: 2 запроса сессии, список популярных авторов (обычно из
+    кэша), подписки на них, подсчёт записей (обычно из кэша) и по
+    запросу на каждую сливаемую выборку постов.
+    Миниатюры новых карточек выбираются одним общим запросом.
+    """
+    streams = [
+        stream.for_feed() for stream in timeline.feed_streams(request.user)
+    ]
+    page_obj = paginate(request, streams)
     context = {
         'page_obj': page_obj,
     }
@@ -128,7 +208,8 @@ def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     follower = Follow.objects.filter(user=request.user, author=author)
     if author != request.user and not follower.exists():
-        Follow.objects.create(user=request.user, author=author)
+        with transaction.atomic():
+            Follow.objects.create(user=request.user, author=author)
     return redirect("posts:profile", username=username)
 
 
@@ -37,6 +37,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.late_render.LateRenderMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
@@ -100,6 +101,51 @@ STATIC_URL = '/static/'
 EMPTY_VALUE_DISPLAY = '-пусто-'
 AMOUNT_PAGES = 10
 
+# Подсчёт записей в лентах: сколько секунд хранить результат в кэше
+# и сколько записей считать точно, прежде чем перейти к оценке.
+FEED_COUNT_CACHE_TIMEOUT = 30
+FEED_COUNT_LIMIT = 10000
+
+# Лента подписок: сколько записей хранить на пользователя
+# и какими пачками раскладывать новый пост по подписчикам.
+TIMELINE_LENGTH = 1000
+TIMELINE_BATCH_SIZE = 500
+# Ленты обрезаются не после каждого поста, а после каждого
+# TIMELINE_TRIM_EVERY-го: лента может ненадолго стать длиннее.
+TIMELINE_TRIM_EVERY = 50
+# Посты авторов с таким числом подписчиков не раскладываются по лентам,
+# а подмешиваются при чтении; список таких авторов кэшируется.
+# После изменения порога выполните manage.py rebuild_timelines.
+TIMELINE_CELEBRITY_FOLLOWERS = 10000
+TIMELINE_CELEBRITIES_CACHE_TIMEOUT = 300
+
+# Массовые действия админки: по сколько записей удалять или менять
+# в одной транзакции.
+BULK_CHUNK_SIZE = 500
+
+# Сколько секунд хранить отрендеренные карточки постов.
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Сколько секунд хранить карточку, миниатюры которой ещё строятся.
+POST_CARD_PENDING_TIMEOUT = 30
+# Сколько секунд хранить целые страницы лент и постов.
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Загружаемые картинки: больше POST_IMAGE_MAX_PIXELS пикселей
+# отклоняются, по длинной стороне уменьшаются до POST_IMAGE_MAX_SIDE
+# и пережимаются с качеством POST_IMAGE_QUALITY. PNG и WebP Pillow
+# декодирует только целиком, поэтому для них предел ниже:
+# POST_IMAGE_MAX_DECODED_PIXELS.
+POST_IMAGE_MAX_PIXELS = 50 * 10 ** 6
+POST_IMAGE_MAX_DECODED_PIXELS = 16 * 10 ** 6
+POST_IMAGE_MAX_SIDE = 2560
+POST_IMAGE_QUALITY = 85
+
+# Сколько потоков строят миниатюры новых картинок; 0 — сразу в запросе.
+POST_THUMBNAIL_WORKERS = 2
+# Сколько потоков выполняют прочую фоновую работу после коммита
+# (см. core.background); 0 — в текущем потоке.
+BACKGROUND_WORKERS = 2
+
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
@@ -112,12 +158,21 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Общий для всех воркеров кэш в файле SQLite, см. core/sqlite_cache.py.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.sqlite_cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'MAX_SIZE': 128 * 2 ** 20,
+        },
     }
 }
 
+# Тесты работают с копией кэша во временном файле.
+TEST_RUNNER = 'core.test_runner.TempCacheRunner'
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]